@@ -1,21 +1,50 @@
 import os
+import threading
+import uuid
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Set, Tuple, Union
 
-import dash
 import dash_bootstrap_components as dbc
+import numpy as np
 import pandas as pd
 import plotly.express as px
-from dash import Input, Output, State, dcc, html
+import plotly.graph_objects as go
+from dash import ClientsideFunction, Input, Output, Patch, State, dcc, html, no_update
 from dash.development.base_component import Component
-from PIL import Image
+from dash.exceptions import PreventUpdate
 from plotly.graph_objects import Figure
 
 import custom_components
 from app import app
+from utilities.annotation_store import get_annotation_store
 from utilities.custom_types import AnyPath
-from utilities.data import read_image
+from utilities.data import move_image, read_image
+from utilities.decoding import get_image_size
+from utilities.image_index import ImageIndex
+from utilities.leasing import LeaseManager
 from utilities.paths import ANNOTATED_ROOT, INPUT_ROOT, ROOT
+from utilities.prediction import MODEL_NAMES
+from utilities.preview import get_preview_masks, render_overlay
+
+_input_index = None  # type: Optional[ImageIndex]
+_input_index_lock = threading.Lock()
+
+# Images are displayed at a reduced resolution, if their longer side exceeds this number of pixels.
+DISPLAY_MAX_SIZE = int(os.getenv("DISPLAY_MAX_SIZE", 2048))
+
+# Time in milliseconds, for which the annotations must not change, before a preview of the masks is requested.
+PREVIEW_DEBOUNCE_INTERVAL = 500
+
+# Every annotation session leases an image, so that concurrent users never annotate the same image.
+LEASE_MANAGER = LeaseManager()
+
+# Images with more pre-existing boxes are shown with all boxes in a single trace, instead of one editable shape per
+# box, which is slow to build and render. A box of the trace becomes an editable shape, once its handle is clicked.
+MAX_EDITABLE_SHAPES = int(os.getenv("MAX_EDITABLE_SHAPES", 200))
+
+# Names of the traces, which show the outlines and the (clickable) centers of boxes, which are not being edited.
+BOX_OUTLINE_TRACE = "box-outlines"
+BOX_HANDLE_TRACE = "box-handles"
 
 ANNOTATION_STYLE = {
     "fillcolor": None,
@@ -68,17 +97,21 @@ def get_layout() -> Component:
 
     :return: Layout of the annotation app.
     """
-    num_images_initial = len(get_image_paths())
-    current_image_path = get_current_image_path()
-    associated_annotations = load_associated_annotations(current_image_path)
-
-    if associated_annotations is not None:
-        annotation_store_content = [dict(row) for _, row in associated_annotations.iterrows()]
-    else:
-        annotation_store_content = []
+    num_images_initial = len(get_input_index())
+    lease_token = uuid.uuid4().hex
+    current_image_path = get_current_image_path(lease_token)
+    annotation_store_content = get_annotation_store_content(current_image_path)
+    fixed_annotations = get_fixed_annotations(annotation_store_content)
 
     layout = dbc.Col(
         [
+            dbc.Alert(
+                "Your session has been inactive for too long and the image has been handed to another user. Your "
+                "annotations of this image can no longer be saved. Please refresh the page.",
+                id="lease-lost",
+                color="warning",
+                is_open=False,
+            ),
             dbc.Row(
                 get_graph_or_message(current_image_path),
                 id="graph-or-message",
@@ -100,6 +133,19 @@ def get_layout() -> Component:
                                     max=num_images_initial,
                                     style={"height": "1vh", "margin-top": "1vh"},
                                 ),
+                                dbc.Switch(
+                                    id="preview-enabled",
+                                    label="Live preview",
+                                    value=False,
+                                    style={"margin-top": "1vh"},
+                                ),
+                                dcc.RadioItems(
+                                    list(MODEL_NAMES),
+                                    "Deep-MARC",
+                                    id="preview-model",
+                                    inline=True,
+                                    inputStyle={"margin-left": "1em", "margin-right": "0.25em"},
+                                ),
                             ],
                             id="annotation-button-and-progress",
                             className="invisible" if current_image_path is None else "visible",
@@ -110,8 +156,15 @@ def get_layout() -> Component:
                 ),
             ),
             dcc.Store(id="image-path", data=str(current_image_path)),
+            dcc.Store(id="lease-token", data=lease_token),
+            dcc.Store(id="lease-renewed"),
+            dcc.Interval(id="interval-lease", interval=LEASE_MANAGER.lease_duration * 1000 / 3),
             dcc.Store(id="num-images-initial", data=num_images_initial),
             dcc.Store(id="store-annotation", data=annotation_store_content),
+            dcc.Store(id="store-annotation-initial", data=annotation_store_content),
+            dcc.Store(id="store-annotation-fixed", data=fixed_annotations),
+            dcc.Store(id="store-preview-request"),
+            dcc.Interval(id="interval-preview", interval=PREVIEW_DEBOUNCE_INTERVAL, disabled=True),
             dcc.Location(id="url-annotation", refresh=True),
         ],
         className="d-flex flex-column",
@@ -168,8 +221,16 @@ def get_figure(image_path: Optional[AnyPath]) -> Figure:
     if image_path is not None:
         image_path = Path(image_path)
 
-        image = read_image(image_path)
+        image = read_image(image_path, max_size=DISPLAY_MAX_SIZE)
         figure = px.imshow(image)
+
+        # Stretch reduced-resolution images, so that the coordinates of the boxes refer to the full resolution.
+        height, width = get_image_size(image_path)
+        scale_x = width / image.shape[1]
+        scale_y = height / image.shape[0]
+        figure.update_traces(dx=scale_x, dy=scale_y, x0=(scale_x - 1) / 2, y0=(scale_y - 1) / 2)
+        figure.update_xaxes(range=[-0.5, width - 0.5])
+        figure.update_yaxes(range=[height - 0.5, -0.5])
         style_annotations(figure)
         style_cursor(figure)
 
@@ -178,11 +239,15 @@ def get_figure(image_path: Optional[AnyPath]) -> Figure:
             plot_bgcolor="rgba(0,0,0,0)",
             modebar=dict(bgcolor="rgba(0,0,0,0)"),
             margin=dict(l=20, r=20, t=40, b=20),
+            # Keep zoom and user-drawn shapes, when the figure is updated (e.g. by the mask preview).
+            uirevision=str(image_path),
         )
 
         boxes = load_associated_annotations(image_path)
 
-        if boxes is not None:
+        if boxes is not None and len(boxes) > MAX_EDITABLE_SHAPES:
+            figure.add_traces(get_box_traces(boxes))
+        elif boxes is not None:
             for _, box in boxes.iterrows():
                 figure.add_shape(
                     editable=True,
@@ -197,6 +262,46 @@ def get_figure(image_path: Optional[AnyPath]) -> Figure:
         return figure
 
 
+def get_box_traces(boxes: pd.DataFrame) -> List[go.Scattergl]:
+    """Get traces, which show many boxes at once: one trace with the outlines of all boxes and one trace with a handle
+    in the center of each box, which can be clicked to edit the box (see `assets/clientside.js`).
+
+    :param boxes: Dataframe with columns ["x0", "y0", "x1", "y1"].
+    :return: Outline trace and handle trace.
+    """
+    x0, y0, x1, y1 = (boxes[key].to_numpy(dtype=np.float64) for key in ("x0", "y0", "x1", "y1"))
+    gaps = np.full(len(boxes), np.nan)
+
+    # Closed outlines, which are separated by gaps.
+    outline_x = np.stack([x0, x1, x1, x0, x0, gaps], axis=1).ravel()
+    outline_y = np.stack([y0, y0, y1, y1, y0, gaps], axis=1).ravel()
+
+    outline_trace = go.Scattergl(
+        x=outline_x,
+        y=outline_y,
+        name=BOX_OUTLINE_TRACE,
+        mode="lines",
+        line=ANNOTATION_STYLE["line"],
+        opacity=ANNOTATION_STYLE["opacity"],
+        connectgaps=False,
+        hoverinfo="none",
+        showlegend=False,
+    )
+    handle_trace = go.Scattergl(
+        x=(x0 + x1) / 2,
+        y=(y0 + y1) / 2,
+        customdata=np.arange(len(boxes)),
+        name=BOX_HANDLE_TRACE,
+        mode="markers",
+        marker={"color": ANNOTATION_STYLE["line"]["color"], "size": 6},
+        opacity=ANNOTATION_STYLE["opacity"],
+        hovertemplate="Click to edit<extra></extra>",
+        showlegend=False,
+    )
+
+    return [outline_trace, handle_trace]
+
+
 def load_associated_annotations(image_path) -> Optional[pd.Series]:
     """Load annotations from an annotation_*.csv file that might exist for an image.
 
@@ -208,30 +313,84 @@ def load_associated_annotations(image_path) -> Optional[pd.Series]:
 
     csv_path = get_associated_csv_path(image_path)
 
-    if csv_path.exists():
-        return pd.read_csv(csv_path, usecols=["x0", "y0", "x1", "y1"])
+    if get_input_index().has_csv(csv_path):
+        return get_annotation_store().load_csv(csv_path)
+
 
+def get_annotation_store_content(image_path: Optional[AnyPath]) -> List[Dict]:
+    """Get the initial content of the annotation data store for an image.
+
+    :param image_path: Path to an image. Can be `None`.
+    :return: List of dictionaries with keys ["x0", "y0", "x1", "y1"].
+    """
+    associated_annotations = load_associated_annotations(image_path)
+
+    if associated_annotations is None:
+        return []
+
+    return associated_annotations.to_dict("records")
+
+
+def get_fixed_annotations(annotations: List[Dict]) -> List[Dict]:
+    """Get the annotations, which are shown in a single trace instead of as editable shapes (see `get_figure`).
+
+    :param annotations: List of dictionaries with keys ["x0", "y0", "x1", "y1"].
+    :return: All annotations, if there are more than `MAX_EDITABLE_SHAPES`, else an empty list.
+    """
+    return annotations if len(annotations) > MAX_EDITABLE_SHAPES else []
 
-def get_current_image_path() -> Optional[AnyPath]:
-    """Get the first image in the `input` folder.
 
-    :return: Path of the first image in the `input` folder.
+def get_input_index() -> ImageIndex:
+    """Get the index of the images in the `input` folder. The index is created and started on first use.
+
+    :return: Index of the images in the `input` folder.
     """
-    image_paths = get_image_paths()
-    if image_paths:
-        return image_paths[0]
+    global _input_index
+
+    with _input_index_lock:
+        if _input_index is None:
+            _input_index = ImageIndex(INPUT_ROOT)
+            _input_index.start()
+
+            # Import all pre-existing annotations at once, instead of one by one, when the images are shown.
+            get_annotation_store().load_csv_files(_input_index.get_csv_paths())
 
+    return _input_index
 
-def get_image_paths() -> List[AnyPath]:
-    """Get list of the paths of the images in the `input` folder.
 
-    :return: List of paths of the images in the `input` folder.
+def get_current_image_path(lease_token: str) -> Optional[AnyPath]:
+    """Get the first image in the `input` folder, which is not currently annotated by another user, and lease it.
+
+    :param lease_token: Token, which identifies the annotation session of a user.
+    :return: Path of the first free image in the `input` folder.
     """
-    image_paths = list(INPUT_ROOT.glob("?*.*"))
-    image_paths = [path for path in image_paths if not path.suffix.lower() == ".csv"]
+    input_index = get_input_index()
+
+    image_path = LEASE_MANAGER.acquire(
+        lease_token, lambda excluded: _str_or_none(_first_existing_image(input_index, excluded))
+    )
+
+    if image_path is not None:
+        return Path(image_path)
 
-    image_paths = sorted(image_paths)
-    return image_paths
+
+def _first_existing_image(input_index: ImageIndex, excluded: Set[str]) -> Optional[Path]:
+    """Get the first image of an index, which still exists. Every worker process has its own index, which may not yet
+    know, that an image has been moved by another worker. Such images are removed from the index.
+
+    :param input_index: Index of the images in the `input` folder.
+    :param excluded: Paths of images to be skipped.
+    :return: Path of the first existing image or None, if there are no images.
+    """
+    while True:
+        image_path = input_index.first(excluded)
+        if image_path is None or image_path.exists():
+            return image_path
+        input_index.discard(image_path)
+
+
+def _str_or_none(path: Optional[AnyPath]) -> Optional[str]:
+    return None if path is None else str(path)
 
 
 def get_image_identifier(image_path: AnyPath) -> str:
@@ -253,23 +412,46 @@ def get_image_identifier(image_path: AnyPath) -> str:
     Output("annotation-button-and-progress", "className"),
     Output("url-annotation", "pathname"),
     Output("progress-annotation", "value"),
+    Output("store-annotation-initial", "data"),
+    Output("store-annotation-fixed", "data"),
     Input("save-next", "n_clicks"),
     State("store-annotation", "data"),
     State("image-path", "data"),
     State("num-images-initial", "data"),
+    State("lease-token", "data"),
     prevent_initial_call=True,
 )
 def save_annotations_and_move_input_image(
-    _, annotations: List[Dict], image_path: str, num_images_initial: int
-) -> Tuple[Union[dcc.Graph, Component], str, str, str, int]:
+    _, annotations: List[Dict], image_path: str, num_images_initial: int, lease_token: str
+) -> Tuple[Union[dcc.Graph, Component], str, str, str, int, List[Dict], List[Dict]]:
     """Save annotations as csv-file. Move csv file and image file to the `annotated` folder.
 
+    The annotations are maintained on the client side (see `assets/clientside.js`), so that the server only receives
+    the final list of boxes, once the user presses the `Save & next` button.
+
+    The annotations are only saved, if the session still holds the lease of the image. Otherwise, a message is shown
+    instead of the next image.
+
     :param _: Mandatory input for the callback. Unused.
     :param annotations: List of dictionaries with keys ["x0", "y0", "x1", "y1"].
     :param image_path: Path of the input image.
     :param num_images_initial: Number of images that can be annotated.
+    :param lease_token: Token, which identifies the annotation session of the user.
+    :return: New graph, image path, button class, path name, progress, initial annotations and fixed annotations of
+        the next image.
     """
 
+    # Another session may have been given the image, after the lease of this session expired.
+    if not LEASE_MANAGER.renew(lease_token, image_path) or not Path(image_path).exists():
+        message = custom_components.Message(
+            dcc.Markdown(
+                f"The annotations were **not saved**, because `{Path(image_path).name}` has been handed to another "
+                f"user, after this session was inactive for too long. Please **[continue](/apps/annotation)** with "
+                f"the next image."
+            )
+        )
+        return message, str(None), "invisible", no_update, no_update, [], []
+
     annotations = pd.DataFrame(annotations)
 
     image_path = Path(image_path)
@@ -284,17 +466,21 @@ def save_annotations_and_move_input_image(
 
     if csv_path_in.exists():
         csv_path_in.unlink()
+    get_input_index().discard(csv_path_in)
 
     # TODO: Sort annotations top-left-bottom-right
     # TODO: Start index at 1.
     csv_path_out = ANNOTATED_ROOT / csv_file_name
     annotations.to_csv(csv_path_out, index=True, index_label="index")
+    get_annotation_store().put(
+        image_identifier, annotations, csv_mtime_ns=csv_path_out.stat().st_mtime_ns
+    )
 
-    output_image_path = ANNOTATED_ROOT / f"image_{image_identifier}.png"
-    Image.open(image_path).save(output_image_path)
-    os.remove(image_path)
+    move_image(image_path, ANNOTATED_ROOT, f"image_{image_identifier}")
+    get_input_index().discard(image_path)
+    LEASE_MANAGER.release(lease_token)
 
-    image_path = get_current_image_path()
+    image_path = get_current_image_path(lease_token)
 
     if image_path is None:
         button_and_progress_class = "invisible"
@@ -305,8 +491,9 @@ def save_annotations_and_move_input_image(
         path_name = "/apps/annotation"
         content = get_graph(image_path)
 
-    num_images_left = len(get_image_paths())
+    num_images_left = len(get_input_index())
     sample_index = num_images_initial - num_images_left
+    annotation_store_content = get_annotation_store_content(image_path)
 
     return (
         content,
@@ -314,88 +501,132 @@ def save_annotations_and_move_input_image(
         button_and_progress_class,
         path_name,
         sample_index,
+        annotation_store_content,
+        get_fixed_annotations(annotation_store_content),
     )
 
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="annotation", function_name="disableButton"),
     Output("save-next", "disabled"),
-    Input("graph-annotation", "figure"),
-    Input("graph-annotation", "relayoutData"),
+    Input("store-annotation", "data"),
 )
-def disable_button(figure: Optional[Dict], _) -> bool:
-    """Check if the `Save & next` button should be activated or not.
 
-    :param figure: annotation graph figure
-    :param _: placeholder, only used to trigger the callback
-    :return: True, if the button should be disabled, false, if not.
-    """
 
-    if "shapes" in figure["layout"]:
-        shapes = figure["layout"]["shapes"]
-    else:
-        return True
+app.clientside_callback(
+    ClientsideFunction(namespace="annotation", function_name="updateAnnotationStore"),
+    Output("store-annotation", "data"),
+    Input("graph-annotation", "relayoutData"),
+    Input("store-annotation-initial", "data"),
+    State("store-annotation-fixed", "data"),
+    State("store-annotation", "data"),
+    prevent_initial_call=True,
+)
 
-    if not shapes:
-        return True
 
-    return False
+app.clientside_callback(
+    ClientsideFunction(namespace="annotation", function_name="editFixedAnnotation"),
+    Output("graph-annotation", "figure", allow_duplicate=True),
+    Output("store-annotation-fixed", "data", allow_duplicate=True),
+    Output("store-annotation", "data", allow_duplicate=True),
+    Input("graph-annotation", "clickData"),
+    State("graph-annotation", "figure"),
+    State("store-annotation-fixed", "data"),
+    State("store-annotation", "data"),
+    prevent_initial_call=True,
+)
 
 
 @app.callback(
-    Output("store-annotation", "data"),
-    Input("graph-annotation", "relayoutData"),
-    State("store-annotation", "data"),
+    Output("lease-renewed", "data"),
+    Input("interval-lease", "n_intervals"),
+    State("lease-token", "data"),
     State("image-path", "data"),
     prevent_initial_call=True,
 )
-def update_annotation_store(
-    relayout_data: Optional[Dict], current_store_state: List[Dict], image_path: str
-) -> List[Dict]:
-    """Update the annotation data store `store-annotation`, if necessary. This workaround is necessary, to always have
-    access to a full set of annotations, independently from the `relayoutData` property of the `graph-annotation`
-    element, which can have all sorts of values, depending on the user interaction.
-
-    :param relayout_data: Graph annotation data.
-    :param current_store_state: Current state of the data store.
-    :param image_path: Path of the input image.
-    :return: Updated state of the data store.
+def renew_lease(_, lease_token: str, image_path: str) -> bool:
+    """Renew the lease of the image that is currently annotated, so that it is not handed out to other users.
+
+    :param _: Mandatory callback input. Unused.
+    :param lease_token: Token, which identifies the annotation session of the user.
+    :param image_path: Path of the image that is currently annotated.
+    :return: True, if the user holds the lease of the image, false, if not.
     """
+    if image_path == str(None):
+        raise PreventUpdate
 
-    if relayout_data is None:  # save-next button pressed
-        associated_annotations = load_associated_annotations(image_path)
+    return LEASE_MANAGER.renew(lease_token, image_path)
 
-        if associated_annotations is not None:
-            annotation_store_content = [dict(row) for _, row in associated_annotations.iterrows()]
-        else:
-            annotation_store_content = []
 
-        return annotation_store_content
-    elif "shapes" in relayout_data:  # There exist annotations or all annotations have been deleted.
-        shapes = relayout_data["shapes"]
-        wanted_keys = ["x0", "y0", "x1", "y1"]
-        annotations = [dict((k, shape[k]) for k in wanted_keys if k in shape) for shape in shapes]
+app.clientside_callback(
+    ClientsideFunction(namespace="annotation", function_name="showLeaseLost"),
+    Output("lease-lost", "is_open"),
+    Input("lease-renewed", "data"),
+    prevent_initial_call=True,
+)
 
-        return annotations
-    elif any(
-        ["shapes" in key for key in relayout_data]
-    ):  # An annotation is currently being updated.
 
-        # Get the index of the annotation that is being manipulated.
-        updated_index = None  # Prevent that `updated_index` is ever undefined.
-        for key in relayout_data:
-            if "shapes" in key:
-                # Keys have the format `shapes[0].x0`.
-                updated_index = int(key[7:][:-4])
+app.clientside_callback(
+    ClientsideFunction(namespace="annotation", function_name="disablePreviewInterval"),
+    Output("interval-preview", "disabled"),
+    Input("preview-enabled", "value"),
+)
 
-        x0 = [relayout_data[key] for key in relayout_data if "x0" in key][0]
-        x1 = [relayout_data[key] for key in relayout_data if "x1" in key][0]
-        y0 = [relayout_data[key] for key in relayout_data if "y0" in key][0]
-        y1 = [relayout_data[key] for key in relayout_data if "y1" in key][0]
 
-        annotations = current_store_state.copy()
-        annotations[updated_index] = dict(x0=x0, x1=x1, y0=y0, y1=y1)
+app.clientside_callback(
+    ClientsideFunction(namespace="annotation", function_name="requestPreview"),
+    Output("store-preview-request", "data"),
+    Input("interval-preview", "n_intervals"),
+    State("interval-preview", "interval"),
+    State("store-annotation", "data"),
+    State("store-annotation", "modified_timestamp"),
+    State("store-preview-request", "data"),
+    State("preview-model", "value"),
+    State("image-path", "data"),
+    prevent_initial_call=True,
+)
 
-        return annotations
 
-    else:  # e.g. freshly loaded page/zooming
-        return dash.no_update
+@app.callback(
+    Output("graph-annotation", "figure"),
+    Input("store-preview-request", "data"),
+    Input("preview-enabled", "value"),
+    prevent_initial_call=True,
+)
+def update_mask_preview(preview_request: Optional[Dict], preview_enabled: bool) -> Patch:
+    """Overlay the annotation graph with a preview of the masks of the current annotations. The masks are cached per
+    box, so that only boxes that have been drawn or changed since the last preview are sent to the model.
+
+    :param preview_request: Dictionary with the keys "boxes", "model" and "image_path".
+    :param preview_enabled: True, if the preview is enabled, false, if not.
+    :return: Partial update of the annotation graph figure.
+    """
+    patched_figure = Patch()
+
+    if not preview_enabled or not preview_request or not preview_request["boxes"]:
+        patched_figure["layout"]["images"] = []
+        return patched_figure
+
+    image_path = preview_request["image_path"]
+    model_name = MODEL_NAMES[preview_request["model"]]
+
+    masks = get_preview_masks(image_path, preview_request["boxes"], model_name)
+    height, width = get_image_size(image_path)
+
+    patched_figure["layout"]["images"] = [
+        {
+            "source": render_overlay((height, width), masks),
+            "xref": "x",
+            "yref": "y",
+            "x": -0.5,
+            "y": -0.5,
+            "sizex": width,
+            "sizey": height,
+            "xanchor": "left",
+            "yanchor": "top",
+            "sizing": "stretch",
+            "layer": "above",
+        }
+    ]
+
+    return patched_figure
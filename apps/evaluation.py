@@ -1,45 +1,36 @@
-import shutil
-from pathlib import Path
 from typing import List, Tuple
 
 import dash_bootstrap_components as dbc
-import pandas as pd
 from dash import Input, Output, State, dcc, html
 from dash.development.base_component import Component
-from PIL import Image
+from dash.exceptions import PreventUpdate
 
 import custom_components
 from app import app
-from utilities.data import read_image
-from utilities.paths import ANNOTATED_ROOT, RESULTS_ROOT, ROOT
-from utilities.prediction import predict_masks
-from utilities.visualization import visualize_annotation
+from utilities.comparison import COMPARISON_MODEL_NAMES
+from utilities.data import get_conversion_failures
+from utilities.evaluation import evaluate_samples as evaluate_sample_batch
+from utilities.evaluation import gather_image_and_csv_paths
+from utilities.paths import ANNOTATED_ROOT, ROOT
+from utilities.prediction import MODEL_NAMES
+from utilities.shared_state import get_shared_state
 
+EVALUATION_JOB = "evaluation"
 
-def gather_image_and_csv_paths() -> Tuple[List[str], List[str]]:
-    """Gather pairs of images and csv annotation files.
+# Evaluate the samples with both models and compare their masks.
+COMPARISON_SELECTION = "Comparison"
 
-    :return: List of image paths and list of csv paths.
-    """
-    csv_paths_unfiltered = list(ANNOTATED_ROOT.glob("*.csv"))
-
-    image_paths = []
-    csv_paths = []
-
-    for csv_path in csv_paths_unfiltered:
-        csv_path = Path(csv_path)
-        image_identifier = csv_path.stem[11:]
 
-        new_image_paths = list(ANNOTATED_ROOT.glob(f"image_{image_identifier}*"))
+def get_model_names(model_selection: str) -> List[str]:
+    """Get the names of the models, which correspond to a model selection.
 
-        # skip samples, where there is no 1:1 pair of csv and image files
-        if len(new_image_paths) != 1:
-            continue
-
-        image_paths.append(str(new_image_paths[0]))
-        csv_paths.append(str(csv_path))
+    :param model_selection: Model selection.
+    :return: List of model names.
+    """
+    if model_selection == COMPARISON_SELECTION:
+        return list(COMPARISON_MODEL_NAMES)
 
-    return image_paths, csv_paths
+    return [MODEL_NAMES[model_selection]]
 
 
 def get_layout() -> Component:
@@ -51,9 +42,25 @@ def get_layout() -> Component:
 
     num_samples = len(image_paths)
 
+    conversion_failures = get_conversion_failures(ANNOTATED_ROOT)
+
     if csv_paths:
         layout = html.Div(
             [
+                dbc.Alert(
+                    [
+                        "The following images could not be converted to png-files. They are evaluated in their "
+                        "original format:",
+                        html.Ul(
+                            [
+                                html.Li(f"{name}: {error}")
+                                for name, error in conversion_failures.items()
+                            ]
+                        ),
+                    ],
+                    color="warning",
+                    is_open=bool(conversion_failures),
+                ),
                 dcc.Location(id="url-evaluation", refresh=True),
                 html.Center(
                     [
@@ -62,7 +69,7 @@ def get_layout() -> Component:
                             size="lg",
                             children=[
                                 dcc.RadioItems(
-                                    ["Deep-MARC", "Deep-MAC"],
+                                    list(MODEL_NAMES) + [COMPARISON_SELECTION],
                                     "Deep-MARC",
                                     id="model-selection",
                                     style={"margin-bottom": "10%"},
@@ -100,17 +107,22 @@ def get_layout() -> Component:
 
 @app.callback(
     Output("progress-evaluation", "value"),
+    Output("progress-evaluation", "max"),
     Input("interval-progress", "n_intervals"),
-    State("image-paths", "data"),
     prevent_initial_call=True,
 )
-def update_progress(_, image_paths: List[str]) -> int:
-    num_samples_total = len(image_paths)
-    num_samples_left = len(gather_image_and_csv_paths()[0])
+def update_progress(_) -> Tuple[int, int]:
+    """Update the progress bar, according to the evaluation job, which might be running in another worker process.
+
+    :param _: Mandatory callback input. Unused.
+    :return: Number of evaluated samples and total number of samples.
+    """
+    job = get_shared_state().get_job(EVALUATION_JOB)
 
-    sample_index = num_samples_total - num_samples_left
+    if job is None:
+        raise PreventUpdate
 
-    return sample_index
+    return job["done"], job["total"]
 
 
 @app.callback(
@@ -133,34 +145,23 @@ def evaluate_samples(
     :param csv_paths:  List of annotation csv paths.
     """
 
-    print(f"🚀🚀🚀🚀 Evaluating with {model_selection}...", flush=True)
-
-    models = {"Deep-MAC": "deepmac", "Deep-MARC": "deepmarc"}
-    model_name = models[model_selection]
-    model_results_root = RESULTS_ROOT / model_name
+    shared_state = get_shared_state()
 
-    for csv_path, image_path in zip(csv_paths, image_paths):
-        csv_path = Path(csv_path)
-        image_path = Path(image_path)
+    if not shared_state.start_job(EVALUATION_JOB, total=len(image_paths)):
+        print("⚠️ An evaluation is already running.", flush=True)
+        raise PreventUpdate
 
-        image = read_image(image_path)
-        image_identifier = csv_path.stem[11:]
-        boxes = pd.read_csv(csv_path)
-        masks = predict_masks(image, boxes, model_name)
-
-        mask_root = model_results_root / "masks"
-        mask_root.mkdir(exist_ok=True, parents=True)
-
-        for mask_id, mask in enumerate(masks):
-            mask = mask > 0.5
-            mask_path = mask_root / f"mask_{image_identifier}_{mask_id}.png"
-            Image.fromarray(mask).save(mask_path)
-
-        visualization_path = model_results_root / f"visualization_{image_identifier}.png"
-        visualization = visualize_annotation(image, masks, boxes)
-        visualization.save(visualization_path)
+    print(f"🚀🚀🚀🚀 Evaluating with {model_selection}...", flush=True)
 
-        shutil.move(image_path, model_results_root / image_path.name)
-        shutil.move(csv_path, model_results_root / csv_path.name)
+    try:
+        summary = evaluate_sample_batch(
+            image_paths,
+            csv_paths,
+            get_model_names(model_selection),
+            on_progress=lambda done: shared_state.update_job(EVALUATION_JOB, done=done),
+        )
+        print(summary, flush=True)
+    finally:
+        shared_state.finish_job(EVALUATION_JOB)
 
     return None, "/apps/results"
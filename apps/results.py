@@ -2,11 +2,14 @@ import base64
 from typing import List
 
 import dash_bootstrap_components as dbc
-from dash import dcc
+from dash import dcc, html
 from dash.development.base_component import Component
+from flask import Response, abort, request, stream_with_context
 
 import custom_components
+from app import server
 from utilities.custom_types import AnyPath
+from utilities.export import gather_result_files, iter_zip
 from utilities.paths import RESULTS_ROOT, ROOT
 
 
@@ -15,7 +18,7 @@ def gather_visualization_paths() -> List[AnyPath]:
 
     :return: List of paths of visualization images.
     """
-    return sorted(list(RESULTS_ROOT.glob("**/visualization_*.*")))
+    return sorted(list(RESULTS_ROOT.glob("*/visualization_*.*")))
 
 
 def b64_image(image_path: AnyPath) -> str:
@@ -29,6 +32,63 @@ def b64_image(image_path: AnyPath) -> str:
     return "data:image/png;base64," + base64.b64encode(image).decode("utf-8")
 
 
+@server.route("/download/<model_name>")
+def download_results(model_name: str) -> Response:
+    """Download the results of a model as zip archive, which is streamed while it is built. The optional query
+    parameter `ids` restricts the archive to a comma-separated list of image ids, e.g. `/download/deepmarc?ids=1,2`
+    for `image_1.png` and `image_2.png`. A leading `image_` is ignored, so that the stems of the image files can be
+    used as well.
+
+    :param model_name: Name of the model.
+    :return: Streamed zip archive.
+    """
+    model_results_root = RESULTS_ROOT / model_name
+
+    if model_name.startswith(".") or not model_results_root.is_dir():
+        abort(404)
+
+    ids = request.args.get("ids")
+    image_identifiers = None
+
+    if ids is not None:
+        image_identifiers = [
+            id_[6:] if id_.startswith("image_") else id_ for id_ in ids.split(",") if id_
+        ]
+
+    paths = gather_result_files(model_results_root, image_identifiers)
+
+    if not paths:
+        abort(404)
+
+    return Response(
+        stream_with_context(iter_zip(RESULTS_ROOT, paths)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{model_name}_results.zip"'},
+    )
+
+
+def get_download_links(model_names: List[str], model_name_mapping: dict) -> Component:
+    """Get links to download the results of each model.
+
+    :param model_names: Names of the models with results.
+    :param model_name_mapping: Display name of each model.
+    :return: Row of download links.
+    """
+    return dbc.Row(
+        dbc.Col(
+            [
+                html.A(
+                    f"Download {model_name_mapping.get(model_name, model_name)} results",
+                    href=f"/download/{model_name}",
+                    className="btn btn-secondary me-2",
+                )
+                for model_name in model_names
+            ]
+        ),
+        style={"margin-bottom": "1%"},
+    )
+
+
 def get_layout() -> Component:
     """Get the layout of the results app.
 
@@ -64,13 +124,18 @@ def get_layout() -> Component:
             for image_id, (image_path, caption) in enumerate(zip(visualization_paths, captions))
         ]
 
+        model_names = sorted({image_path.parent.name for image_path in visualization_paths})
+
         layout = dbc.Col(
-            dbc.Carousel(
-                items=carousel_items,
-                controls=True,
-                indicators=True,
-                style={"height": "100%"},
-            ),
+            [
+                get_download_links(model_names, model_name_mapping),
+                dbc.Carousel(
+                    items=carousel_items,
+                    controls=True,
+                    indicators=True,
+                    style={"height": "100%"},
+                ),
+            ],
             className="d-flex flex-column",
             style={"margin-top": "2%"},
             # TODO: Add re-annotate button.
@@ -0,0 +1,207 @@
+// Clientside callbacks, to avoid server round trips for frequent, purely cosmetic updates.
+
+const SHAPE_KEY_PATTERN = /^shapes\[(\d+)\]\.(x0|y0|x1|y1)$/;
+const BOX_KEYS = ["x0", "y0", "x1", "y1"];
+
+// Names of the traces, which show boxes that are not being edited (see `get_box_traces` in `apps/annotation.py`).
+const BOX_OUTLINE_TRACE = "box-outlines";
+const BOX_HANDLE_TRACE = "box-handles";
+
+/**
+ * Get the coordinates of the closed outlines of boxes, separated by gaps.
+ *
+ * @param boxes List of boxes with keys x0, y0, x1, y1.
+ * @returns Properties x and y of the outline trace.
+ */
+function getBoxOutlines(boxes) {
+    const x = [];
+    const y = [];
+    boxes.forEach(function (box) {
+        x.push(box.x0, box.x1, box.x1, box.x0, box.x0, null);
+        y.push(box.y0, box.y0, box.y1, box.y1, box.y0, null);
+    });
+    return {x: x, y: y};
+}
+
+/**
+ * Get the coordinates of the handles in the centers of boxes.
+ *
+ * @param boxes List of boxes with keys x0, y0, x1, y1.
+ * @returns Properties x, y and customdata (index of the box) of the handle trace.
+ */
+function getBoxHandles(boxes) {
+    return {
+        x: boxes.map((box) => (box.x0 + box.x1) / 2),
+        y: boxes.map((box) => (box.y0 + box.y1) / 2),
+        customdata: boxes.map((box, index) => index),
+    };
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    annotation: {
+        /**
+         * Update the annotation data store `store-annotation`, if necessary. This workaround is necessary, to always
+         * have access to a full set of annotations, independently from the `relayoutData` property of the
+         * `graph-annotation` element, which can have all sorts of values, depending on the user interaction.
+         *
+         * The data store contains the fixed annotations, which are shown in a single trace, followed by the annotations,
+         * which are shown as editable shapes.
+         *
+         * @param relayoutData Graph annotation data.
+         * @param initialAnnotations Annotations of the current image, as they were loaded from disk.
+         * @param fixedAnnotations Annotations, which are not shown as editable shapes.
+         * @param currentAnnotations Current state of the data store.
+         * @returns Updated state of the data store.
+         */
+        updateAnnotationStore: function (relayoutData, initialAnnotations, fixedAnnotations, currentAnnotations) {
+            const triggered = dash_clientside.callback_context.triggered.map((t) => t.prop_id);
+
+            if (triggered.includes("store-annotation-initial.data")) {  // save-next button pressed
+                return initialAnnotations || [];
+            }
+
+            if (!relayoutData) {
+                return dash_clientside.no_update;
+            }
+
+            const fixed = fixedAnnotations || [];
+
+            if ("shapes" in relayoutData) {  // There exist annotations or all annotations have been deleted.
+                return fixed.concat(relayoutData.shapes.map(function (shape) {
+                    const box = {};
+                    BOX_KEYS.forEach(function (key) {
+                        if (key in shape) {
+                            box[key] = shape[key];
+                        }
+                    });
+                    return box;
+                }));
+            }
+
+            // An annotation is currently being updated. Keys have the format `shapes[0].x0`.
+            const annotations = (currentAnnotations || []).slice();
+            let isUpdated = false;
+
+            Object.keys(relayoutData).forEach(function (key) {
+                const match = SHAPE_KEY_PATTERN.exec(key);
+                if (match === null) {
+                    return;
+                }
+                const index = fixed.length + parseInt(match[1], 10);
+                annotations[index] = Object.assign({}, annotations[index], {[match[2]]: relayoutData[key]});
+                isUpdated = true;
+            });
+
+            if (!isUpdated) {  // e.g. freshly loaded page/zooming
+                return dash_clientside.no_update;
+            }
+
+            return annotations;
+        },
+
+        /**
+         * Turn a fixed annotation into an editable shape, once the handle in its center is clicked.
+         *
+         * @param clickData Data of the clicked point.
+         * @param figure Current figure of the annotation graph.
+         * @param fixedAnnotations Annotations, which are not shown as editable shapes.
+         * @param currentAnnotations Current state of the annotation data store.
+         * @returns Updated figure, fixed annotations and annotation data store.
+         */
+        editFixedAnnotation: function (clickData, figure, fixedAnnotations, currentAnnotations) {
+            const noUpdate = [dash_clientside.no_update, dash_clientside.no_update, dash_clientside.no_update];
+
+            if (!clickData || !clickData.points.length || !figure) {
+                return noUpdate;
+            }
+
+            const point = clickData.points[0];
+            const trace = figure.data[point.curveNumber];
+            const fixed = fixedAnnotations || [];
+
+            if (!trace || trace.name !== BOX_HANDLE_TRACE || !(point.customdata in fixed)) {
+                return noUpdate;
+            }
+
+            const remaining = fixed.filter((box, index) => index !== point.customdata);
+            const editable = (currentAnnotations || []).slice(fixed.length).concat([fixed[point.customdata]]);
+            const style = figure.layout.newshape || {};
+
+            const updatedFigure = Object.assign({}, figure, {
+                data: figure.data.map(function (trace) {
+                    if (trace.name === BOX_OUTLINE_TRACE) {
+                        return Object.assign({}, trace, getBoxOutlines(remaining));
+                    }
+                    if (trace.name === BOX_HANDLE_TRACE) {
+                        return Object.assign({}, trace, getBoxHandles(remaining));
+                    }
+                    return trace;
+                }),
+                layout: Object.assign({}, figure.layout, {
+                    shapes: editable.map((box) => Object.assign(
+                        {type: "rect", editable: true, fillcolor: style.fillcolor, opacity: style.opacity, line: style.line},
+                        box,
+                    )),
+                }),
+            });
+
+            return [updatedFigure, remaining, remaining.concat(editable)];
+        },
+
+        /**
+         * Check if the `Save & next` button should be activated or not.
+         *
+         * @param annotations Current state of the annotation data store.
+         * @returns True, if the button should be disabled, false, if not.
+         */
+        disableButton: function (annotations) {
+            return !annotations || annotations.length === 0;
+        },
+
+        /**
+         * Only poll for mask previews, if the preview is enabled.
+         *
+         * @param previewEnabled True, if the preview is enabled, false, if not.
+         * @returns True, if the preview interval should be disabled, false, if not.
+         */
+        disablePreviewInterval: function (previewEnabled) {
+            return !previewEnabled;
+        },
+
+        /**
+         * Warn the user, if the lease of the current image could not be renewed.
+         *
+         * @param leaseRenewed True, if the lease has been renewed, false, if not.
+         * @returns True, if the warning should be shown, false, if not.
+         */
+        showLeaseLost: function (leaseRenewed) {
+            return leaseRenewed === false;
+        },
+
+        /**
+         * Request a preview of the masks, once the annotations have not changed for a full interval (debouncing).
+         *
+         * @param nIntervals Mandatory callback input. Unused.
+         * @param interval Debounce interval in milliseconds.
+         * @param annotations Current state of the annotation data store.
+         * @param modifiedTimestamp Time of the last change of the annotation data store.
+         * @param lastRequest Previous preview request.
+         * @param model Selected model.
+         * @param imagePath Path of the current image.
+         * @returns New preview request, with the keys "boxes", "model" and "image_path".
+         */
+        requestPreview: function (nIntervals, interval, annotations, modifiedTimestamp, lastRequest, model, imagePath) {
+            if (modifiedTimestamp && Date.now() - modifiedTimestamp < interval) {
+                return dash_clientside.no_update;
+            }
+
+            const request = {boxes: annotations || [], model: model, image_path: imagePath};
+
+            if (JSON.stringify(request) === JSON.stringify(lastRequest)) {
+                return dash_clientside.no_update;
+            }
+
+            return request;
+        },
+    },
+});
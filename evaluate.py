@@ -0,0 +1,118 @@
+"""Evaluate annotated samples without the user interface, e.g. for nightly jobs.
+
+Example (from within the client container):
+    python evaluate.py --model Deep-MARC --processes 4 --concurrent-requests 2
+"""
+
+import argparse
+import multiprocessing
+from pathlib import Path
+
+from utilities import prediction
+from utilities.comparison import COMPARISON_MODEL_NAMES
+from utilities.evaluation import evaluate_samples, gather_image_and_csv_paths
+from utilities.paths import ANNOTATED_ROOT, RESULTS_ROOT
+from utilities.prediction import MODEL_NAMES
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Parse the command line arguments.
+
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "input",
+        nargs="?",
+        type=Path,
+        default=ANNOTATED_ROOT,
+        help="Folder with pairs of `image_*` and `annotation_*.csv` files (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=RESULTS_ROOT,
+        help="Results folder. The results of each model are placed in a sub folder (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--model",
+        choices=list(MODEL_NAMES),
+        default="Deep-MARC",
+        help="Model (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Evaluate the samples with both models and compare their masks (ignores --model).",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of processes for decoding images and encoding results (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--concurrent-requests",
+        type=int,
+        default=2,
+        help="Number of concurrent inference requests (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--inference-backend",
+        choices=["rest", "embedded"],
+        default=prediction.INFERENCE_BACKEND,
+        help="Send requests to the model server (rest) or load the models into this process (embedded)\n"
+        "(default: %(default)s).",
+    )
+    parser.add_argument(
+        "--model-host",
+        default=prediction.MODEL_HOST,
+        help="Host of the model server (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--port-backend",
+        default=prediction.PORT_BACKEND,
+        help="REST port of the model server (default: %(default)s).",
+    )
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+
+    prediction.INFERENCE_BACKEND = arguments.inference_backend
+    prediction.MODEL_HOST = arguments.model_host
+    prediction.PORT_BACKEND = arguments.port_backend
+
+    image_paths, csv_paths = gather_image_and_csv_paths(arguments.input)
+
+    if not image_paths:
+        print(f"There are no valid pairs of csv- and image-files in {arguments.input}.", flush=True)
+        return
+
+    if arguments.compare:
+        model_names = list(COMPARISON_MODEL_NAMES)
+    else:
+        model_names = [MODEL_NAMES[arguments.model]]
+
+    print(f"🚀 Evaluating {len(image_paths)} samples with {', '.join(model_names)}...", flush=True)
+
+    summary = evaluate_samples(
+        image_paths,
+        csv_paths,
+        model_names,
+        results_root=arguments.output,
+        num_processes=arguments.processes,
+        num_concurrent_requests=arguments.concurrent_requests,
+        on_progress=lambda done: print(f"{done}/{len(image_paths)}", end="\r", flush=True),
+    )
+
+    print(summary, flush=True)
+
+
+if __name__ == "__main__":
+    # TensorFlow is not fork-safe, so the worker processes are spawned.
+    multiprocessing.set_start_method("spawn")
+    main()
@@ -0,0 +1,19 @@
+"""Configuration of the production server (`SERVER_MODE=production`).
+
+See: https://docs.gunicorn.org/en/stable/settings.html
+"""
+
+import os
+
+bind = f"0.0.0.0:{int(os.getenv('PORT_FRONTEND', 8051))}"
+
+# Every worker process serves several requests at a time, using threads. State that needs to be shared between the
+# workers (e.g. leases of images and the status of evaluation jobs) is stored in `utilities.shared_state`.
+worker_class = "gthread"
+workers = int(os.getenv("WEB_WORKERS", 4))
+threads = int(os.getenv("WEB_THREADS", 4))
+
+# Evaluations run within a single request and can take a long time.
+timeout = int(os.getenv("WEB_TIMEOUT", 3600))
+
+accesslog = "-"
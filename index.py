@@ -6,11 +6,13 @@ from dash import dcc
 from dash.dependencies import Input, Output
 from dash.development.base_component import Component
 
-from app import app
+from app import app, server
 from apps import annotation, evaluation, menu, results
+from utilities import profiler
 
 PORT_FRONTEND = int(os.getenv("PORT_FRONTEND", 8051))
 USE_DEBUGGER = os.getenv("DEBUGGER", "False").lower() in ("true", "1", "t")
+SERVER_MODE = os.getenv("SERVER_MODE", "development").lower()  # "development" or "production"
 IP = "0.0.0.0"
 
 app.layout = dbc.Container(
@@ -51,6 +53,14 @@ def display_page(path_name: str) -> Tuple[Component, Component, str]:
     return page_layout, menu.get_layout(), path_name
 
 
+profiler.initialize_if_needed(app)
+
+
 if __name__ == "__main__":
     print("🚀 Starting frontend", flush=True)
-    app.run_server(host=IP, port=PORT_FRONTEND, debug=USE_DEBUGGER, dev_tools_ui=USE_DEBUGGER)
+
+    if SERVER_MODE == "production":
+        # Replace this process with a WSGI server, which runs multiple worker processes and threads.
+        os.execvp("gunicorn", ["gunicorn", "--config", "gunicorn.conf.py", "index:server"])
+    else:
+        app.run_server(host=IP, port=PORT_FRONTEND, debug=USE_DEBUGGER, dev_tools_ui=USE_DEBUGGER)
@@ -0,0 +1,499 @@
+"""Simulate concurrent annotation sessions against a running application and report the latency of its callbacks.
+
+Every session loads the annotation page, requests mask previews while "drawing" boxes (box edits are handled in the
+browser, so the previews are the server load they cause), renews its lease and saves its annotations with
+"Save & next", until there are no more images. Optionally, an evaluation is started afterwards.
+
+WARNING: The sessions annotate (and the evaluation moves) the images of the `input` folder, so only run this against
+a copy of your data. Synthetic images can be generated with `--generate-images`.
+
+Example (from within the client container, with a stand-in for the model server):
+    PORT_BACKEND=8601 python index.py &
+    python load_test.py --generate-images 100 --sessions 8 --model-port 8601 --evaluate
+"""
+
+import argparse
+import json
+import random
+import socketserver
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import requests
+from PIL import Image
+
+from utilities.paths import INPUT_ROOT
+
+# Side length of the masks, which are returned by the stand-in for the model server.
+MASK_SIZE = 32
+
+
+class LatencyRecorder:
+    """Thread-safe collection of the latencies and errors of requests, grouped by callback."""
+
+    def __init__(self):
+        self._latencies = defaultdict(list)  # type: Dict[str, List[float]]
+        self._errors = defaultdict(int)  # type: Dict[str, int]
+        self._lock = threading.Lock()
+
+    def record(self, name: str, latency: float, is_error: bool):
+        """Record a request.
+
+        :param name: Name of the callback.
+        :param latency: Latency in seconds.
+        :param is_error: True, if the request failed, false, if not.
+        """
+        with self._lock:
+            self._latencies[name].append(latency)
+            if is_error:
+                self._errors[name] += 1
+
+    def get_report(self) -> str:
+        """Get a table with the number of requests, the error rate and latency percentiles per callback.
+
+        :return: Report.
+        """
+        lines = [
+            f"{'callback':<40} {'requests':>8} {'errors':>7} {'p50/ms':>9} {'p90/ms':>9} {'p99/ms':>9} {'max/ms':>9}"
+        ]
+
+        with self._lock:
+            for name, latencies in sorted(self._latencies.items()):
+                p50, p90, p99, maximum = np.percentile(
+                    np.array(latencies) * 1000, [50, 90, 99, 100]
+                )
+                error_rate = self._errors[name] / len(latencies)
+                lines.append(
+                    f"{name:<40} {len(latencies):>8} {error_rate:>7.1%} {p50:>9.1f} {p90:>9.1f} {p99:>9.1f} "
+                    f"{maximum:>9.1f}"
+                )
+
+        return "\n".join(lines)
+
+
+class DashSession:
+    """Browser session, which triggers the server-side callbacks of the application via HTTP."""
+
+    def __init__(self, url: str, recorder: LatencyRecorder, timeout: float):
+        """
+        :param url: Base url of the application.
+        :param recorder: Recorder of the latencies.
+        :param timeout: Timeout of a request in seconds.
+        """
+        self.url = url.rstrip("/")
+        self.recorder = recorder
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def load_page(self):
+        """Load the page and the callback definitions, like a browser does."""
+        for name, path in (
+            ("page", "/"),
+            ("layout", "/_dash-layout"),
+            ("dependencies", "/_dash-dependencies"),
+        ):
+            self._request(name, "GET", path)
+
+    def call(
+        self,
+        name: str,
+        outputs: Sequence[Tuple[str, str]],
+        inputs: Sequence[Tuple[str, str, Any]],
+        states: Sequence[Tuple[str, str, Any]] = (),
+    ) -> Optional[Dict]:
+        """Trigger a callback, like the Dash renderer does, with the first input as changed property.
+
+        :param name: Name of the callback (for the report).
+        :param outputs: List of (component id, property) of the outputs.
+        :param inputs: List of (component id, property, value) of the inputs.
+        :param states: List of (component id, property, value) of the states.
+        :return: Updated properties by component id, or None, if there was no update or the request failed.
+        """
+        output_specs = [{"id": component_id, "property": prop} for component_id, prop in outputs]
+        output_ids = [f"{component_id}.{prop}" for component_id, prop in outputs]
+
+        payload = {
+            "output": output_ids[0] if len(outputs) == 1 else f"..{'...'.join(output_ids)}..",
+            "outputs": output_specs[0] if len(outputs) == 1 else output_specs,
+            "inputs": [
+                {"id": component_id, "property": prop, "value": value}
+                for component_id, prop, value in inputs
+            ],
+            "changedPropIds": [f"{inputs[0][0]}.{inputs[0][1]}"],
+            "state": [
+                {"id": component_id, "property": prop, "value": value}
+                for component_id, prop, value in states
+            ],
+        }
+
+        response = self._request(name, "POST", "/_dash-update-component", json=payload)
+
+        if response is None or response.status_code == 204:  # 204: PreventUpdate
+            return None
+
+        return response.json()["response"]
+
+    def _request(self, name: str, method: str, path: str, **kwargs) -> Optional[requests.Response]:
+        start = time.perf_counter()
+
+        try:
+            response = self._session.request(
+                method, self.url + path, timeout=self.timeout, **kwargs
+            )
+        except requests.RequestException:
+            self.recorder.record(name, time.perf_counter() - start, is_error=True)
+            return None
+
+        self.recorder.record(
+            name, time.perf_counter() - start, is_error=response.status_code >= 400
+        )
+        return response if response.status_code < 400 else None
+
+
+class ModelRequestHandler(BaseHTTPRequestHandler):
+    """Stand-in for the REST API of the model server, which answers with box-shaped masks of the requested number of
+    instances after a fixed latency."""
+
+    latency = 0.0  # in seconds
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        mask = np.ones((MASK_SIZE, MASK_SIZE)).tolist()
+
+        if "instances" in request:  # Deep-MAC
+            num_instances = len(request["instances"][0]["boxes"])
+            body = {"predictions": [{"detection_masks": [mask] * num_instances}]}
+        else:  # Deep-MARC
+            num_instances = len(request["inputs"]["boxes"][0])
+            body = {"outputs": [[mask] * num_instances]}
+
+        time.sleep(self.latency)
+
+        encoded_body = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded_body)))
+        self.end_headers()
+        self.wfile.write(encoded_body)
+
+    def log_message(self, *_):
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_model_server(port: int, latency: float) -> ThreadingHTTPServer:
+    """Start a stand-in for the model server in a background thread.
+
+    :param port: Port of the REST API.
+    :param latency: Latency of every prediction in seconds.
+    :return: Server.
+    """
+    ModelRequestHandler.latency = latency
+    server = ThreadingHTTPServer(("0.0.0.0", port), ModelRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def generate_images(root: Path, num_images: int, size: int):
+    """Generate random images to annotate.
+
+    :param root: Output folder.
+    :param num_images: Number of images.
+    :param size: Side length of the images.
+    """
+    root.mkdir(exist_ok=True, parents=True)
+    random_state = np.random.RandomState(0)
+
+    for index in range(num_images):
+        image = random_state.randint(0, 256, (size, size, 3), dtype=np.uint8)
+        Image.fromarray(image).save(root / f"load_test_{index:05d}.png")
+
+
+def find_props(tree: Any, component_id: str) -> Optional[Dict]:
+    """Find the properties of a component within a serialized layout.
+
+    :param tree: Serialized layout.
+    :param component_id: Id of the component.
+    :return: Properties of the component or None, if there is no such component.
+    """
+    if isinstance(tree, dict):
+        props = tree.get("props")
+        if isinstance(props, dict) and props.get("id") == component_id:
+            return props
+        children = tree.values()
+    elif isinstance(tree, list):
+        children = tree
+    else:
+        return None
+
+    for child in children:
+        props = find_props(child, component_id)
+        if props is not None:
+            return props
+
+    return None
+
+
+def open_page(session: DashSession, path_name: str) -> Any:
+    """Open a page of the application.
+
+    :param session: Session.
+    :param path_name: Path of the page.
+    :return: Serialized layout of the page.
+    """
+    session.load_page()
+    response = session.call(
+        "display_page",
+        [("page-content", "children"), ("navigation", "children"), ("url-index", "pathname")],
+        [("url-index", "pathname", path_name)],
+    )
+    return None if response is None else response["page-content"]["children"]
+
+
+def random_box(size: int, random_state: random.Random) -> Dict[str, float]:
+    """Get a random box.
+
+    :param size: Range of the box coordinates.
+    :param random_state: Random number generator.
+    :return: Dictionary with keys ["x0", "y0", "x1", "y1"].
+    """
+    x0, y0 = random_state.uniform(0, size * 0.9), random_state.uniform(0, size * 0.9)
+    width, height = random_state.uniform(10, size * 0.1), random_state.uniform(10, size * 0.1)
+    return {"x0": x0, "y0": y0, "x1": x0 + width, "y1": y0 + height}
+
+
+def run_annotation_session(
+    session: DashSession, num_boxes: int, think_time: float, image_size: int, seed: int
+) -> int:
+    """Annotate images, until there are no more images.
+
+    :param session: Session.
+    :param num_boxes: Number of boxes per image.
+    :param think_time: Time in seconds between two box edits.
+    :param image_size: Range of the box coordinates.
+    :param seed: Seed of the random boxes.
+    :return: Number of annotated images.
+    """
+    random_state = random.Random(seed)
+    layout = open_page(session, "/apps/annotation")
+
+    if layout is None:
+        return 0
+
+    lease_token = find_props(layout, "lease-token")["data"]
+    num_images_initial = find_props(layout, "num-images-initial")["data"]
+    image_path = find_props(layout, "image-path")["data"]
+    num_annotated = 0
+
+    while image_path != "None":
+        boxes = []
+
+        session.call(
+            "renew_lease",
+            [("lease-renewed", "data")],
+            [("interval-lease", "n_intervals", num_annotated + 1)],
+            [("lease-token", "data", lease_token), ("image-path", "data", image_path)],
+        )
+
+        for _ in range(num_boxes):
+            time.sleep(think_time)
+            boxes.append(random_box(image_size, random_state))
+            preview_request = {"boxes": boxes, "model": "Deep-MARC", "image_path": image_path}
+            session.call(
+                "update_mask_preview",
+                [("graph-annotation", "figure")],
+                [
+                    ("store-preview-request", "data", preview_request),
+                    ("preview-enabled", "value", True),
+                ],
+            )
+
+        response = session.call(
+            "save_annotations_and_move_input_image",
+            [
+                ("graph-or-message", "children"),
+                ("image-path", "data"),
+                ("annotation-button-and-progress", "className"),
+                ("url-annotation", "pathname"),
+                ("progress-annotation", "value"),
+                ("store-annotation-initial", "data"),
+                ("store-annotation-fixed", "data"),
+            ],
+            [("save-next", "n_clicks", num_annotated + 1)],
+            [
+                ("store-annotation", "data", boxes),
+                ("image-path", "data", image_path),
+                ("num-images-initial", "data", num_images_initial),
+                ("lease-token", "data", lease_token),
+            ],
+        )
+
+        if response is None:
+            break
+
+        image_path = response["image-path"]["data"]
+        num_annotated += 1
+
+    return num_annotated
+
+
+def run_evaluation(session: DashSession, model_selection: str):
+    """Start an evaluation of all annotated images and poll its progress, like the evaluation page does.
+
+    :param session: Session.
+    :param model_selection: Model selection.
+    """
+    layout = open_page(session, "/apps/evaluation")
+
+    if layout is None or find_props(layout, "image-paths") is None:
+        print("There are no annotated images to evaluate.", flush=True)
+        return
+
+    image_paths = find_props(layout, "image-paths")["data"]
+    csv_paths = find_props(layout, "csv-paths")["data"]
+    is_finished = threading.Event()
+
+    def poll_progress():
+        n_intervals = 0
+        while not is_finished.wait(1):
+            n_intervals += 1
+            session.call(
+                "update_progress",
+                [("progress-evaluation", "value"), ("progress-evaluation", "max")],
+                [("interval-progress", "n_intervals", n_intervals)],
+            )
+
+    polling_thread = threading.Thread(target=poll_progress, daemon=True)
+    polling_thread.start()
+
+    try:
+        session.call(
+            "evaluate_samples",
+            [("dummy-evaluation", "children"), ("url-evaluation", "pathname")],
+            [("evaluate", "n_clicks", 1)],
+            [
+                ("model-selection", "value", model_selection),
+                ("image-paths", "data", image_paths),
+                ("csv-paths", "data", csv_paths),
+            ],
+        )
+    finally:
+        is_finished.set()
+        polling_thread.join()
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Parse the command line arguments.
+
+    :return: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--url",
+        default="http://localhost:8502",
+        help="Url of the application (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=4,
+        help="Number of concurrent sessions (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--boxes", type=int, default=5, help="Number of boxes per image (default: %(default)s)."
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.5,
+        help="Time in seconds between two box edits (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--generate-images",
+        type=int,
+        default=0,
+        help="Number of synthetic images, which are placed in the input folder before the test (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--image-size",
+        type=int,
+        default=1024,
+        help="Side length of the synthetic images (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--model-port",
+        type=int,
+        default=None,
+        help="If specified, a stand-in for the model server is started on this port. The application needs to use "
+        "it as backend (`MODEL_HOST`, `PORT_BACKEND`).",
+    )
+    parser.add_argument(
+        "--model-latency",
+        type=float,
+        default=0.2,
+        help="Latency of the stand-in for the model server in seconds (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--evaluate",
+        action="store_true",
+        help="Start an evaluation with Deep-MARC, once all sessions have finished.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="Timeout of a request in seconds (default: %(default)s).",
+    )
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+
+    if arguments.generate_images:
+        generate_images(INPUT_ROOT, arguments.generate_images, arguments.image_size)
+
+    if arguments.model_port is not None:
+        start_model_server(arguments.model_port, arguments.model_latency)
+
+    recorder = LatencyRecorder()
+    num_annotated = [0] * arguments.sessions
+
+    def run_session(index: int):
+        session = DashSession(arguments.url, recorder, arguments.timeout)
+        num_annotated[index] = run_annotation_session(
+            session, arguments.boxes, arguments.think_time, arguments.image_size, seed=index
+        )
+
+    print(f"🚀 Starting {arguments.sessions} sessions against {arguments.url}...", flush=True)
+
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=run_session, args=(index,)) for index in range(arguments.sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    print(f"Annotated {sum(num_annotated)} images in {duration:.1f} s.", flush=True)
+
+    if arguments.evaluate:
+        run_evaluation(DashSession(arguments.url, recorder, arguments.timeout), "Deep-MARC")
+
+    print(recorder.get_report(), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Consolidated store of the boxes of all images, backed by SQLite.
+
+The `annotation_<id>.csv` files remain the exchange format: they are imported into the store, the first time they are
+read (and again, whenever they are modified), and they are still written, whenever annotations are saved. Reading the
+boxes of many images from the store only takes a single query, instead of parsing one csv file per image.
+"""
+
+import csv
+import math
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import pandas as pd
+
+from .custom_types import AnyPath
+from .shared_state import SQLiteDatabase
+
+# The store only caches the contents of the csv files, so it is placed in a folder within the container, like the
+# shared state. SQLite's WAL mode needs shared memory, which does not work reliably on bind mounts of Docker Desktop.
+ANNOTATION_STORE_PATH = os.getenv(
+    "ANNOTATION_STORE_PATH", "/tmp/semiautomaticannotation-annotations.sqlite"
+)
+
+BOX_COLUMNS = ["x0", "y0", "x1", "y1"]
+
+# Maximum number of parameters of a single SQLite statement (SQLITE_MAX_VARIABLE_NUMBER of older SQLite versions).
+_MAX_PARAMETERS = 999
+
+
+class AnnotationStore(SQLiteDatabase):
+    """Boxes of all images, indexed by image id."""
+
+    def __init__(self, path: AnyPath = ANNOTATION_STORE_PATH, timeout: float = 30):
+        """
+        :param path: Path of the database file.
+        :param timeout: Time in seconds to wait for a lock of the database.
+        """
+        super().__init__(path, timeout)
+
+    def _create_tables(self, connection: sqlite3.Connection):
+        # `csv_mtime_ns` is the modification time of the csv file, the boxes were imported from or exported to.
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS annotations "
+            "(image_id TEXT PRIMARY KEY, csv_mtime_ns INTEGER)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS boxes "
+            "(image_id TEXT NOT NULL, box_index INTEGER NOT NULL, "
+            "x0 REAL NOT NULL, y0 REAL NOT NULL, x1 REAL NOT NULL, y1 REAL NOT NULL, "
+            "PRIMARY KEY (image_id, box_index)) WITHOUT ROWID"
+        )
+
+    def put(self, image_identifier: str, boxes: pd.DataFrame, csv_mtime_ns: Optional[int] = None):
+        """Store the boxes of an image and replace previously stored boxes.
+
+        :param image_identifier: Image id.
+        :param boxes: Dataframe with columns ["x0", "y0", "x1", "y1"]. An image without boxes may also be passed as
+            dataframe without columns.
+        :param csv_mtime_ns: Modification time of the corresponding csv file, if any.
+        """
+        boxes = boxes.reindex(columns=BOX_COLUMNS).dropna()
+
+        with self.transaction() as connection:
+            self._put(connection, image_identifier, boxes.values.tolist(), csv_mtime_ns)
+
+    def get(self, image_identifier: str) -> Optional[pd.DataFrame]:
+        """Get the boxes of an image.
+
+        :param image_identifier: Image id.
+        :return: Dataframe with columns ["x0", "y0", "x1", "y1"] or None, if there are no annotations of the image.
+        """
+        return self.get_many([image_identifier]).get(image_identifier)
+
+    def get_many(self, image_identifiers: Sequence[str]) -> Dict[str, pd.DataFrame]:
+        """Get the boxes of many images at once.
+
+        :param image_identifiers: Image ids.
+        :return: Dataframe with columns ["x0", "y0", "x1", "y1"] by image id. Images without annotations are
+            omitted.
+        """
+        rows = []
+        known_identifiers = []
+
+        for chunk in _chunks(list(image_identifiers), _MAX_PARAMETERS):
+            placeholders = ",".join("?" * len(chunk))
+            known_identifiers += [
+                row[0]
+                for row in self.connection.execute(
+                    f"SELECT image_id FROM annotations WHERE image_id IN ({placeholders})", chunk
+                )
+            ]
+            rows += self.connection.execute(
+                f"SELECT image_id, x0, y0, x1, y1 FROM boxes WHERE image_id IN ({placeholders}) "
+                f"ORDER BY image_id, box_index",
+                chunk,
+            ).fetchall()
+
+        boxes = pd.DataFrame(rows, columns=["image_id"] + BOX_COLUMNS)
+        boxes_by_identifier = {
+            image_identifier: group[BOX_COLUMNS].reset_index(drop=True)
+            for image_identifier, group in boxes.groupby("image_id", sort=False)
+        }
+
+        # Images, whose annotations have no boxes.
+        for image_identifier in known_identifiers:
+            if image_identifier not in boxes_by_identifier:
+                boxes_by_identifier[image_identifier] = pd.DataFrame(
+                    columns=BOX_COLUMNS, dtype=float
+                )
+
+        return boxes_by_identifier
+
+    def load_csv(self, csv_path: AnyPath) -> pd.DataFrame:
+        """Get the boxes of an `annotation_<id>.csv` file, see `load_csv_files`.
+
+        :param csv_path: Path of the csv file.
+        :return: Dataframe with columns ["x0", "y0", "x1", "y1"].
+        """
+        return self.load_csv_files([csv_path])[0]
+
+    def load_csv_files(self, csv_paths: Sequence[AnyPath]) -> List[pd.DataFrame]:
+        """Get the boxes of many `annotation_<id>.csv` files at once. Only files, which have not been imported yet or
+        which have been modified since, are parsed and imported into the store. Files, which no longer exist (e.g.
+        because they have been moved), are read from the store.
+
+        :param csv_paths: Paths of the csv files.
+        :return: Dataframe with columns ["x0", "y0", "x1", "y1"] per csv file.
+        """
+        csv_paths = [Path(csv_path) for csv_path in csv_paths]
+        image_identifiers = [get_image_identifier_from_csv(csv_path) for csv_path in csv_paths]
+        modification_times = self._get_modification_times(image_identifiers)
+
+        outdated = [
+            (image_identifier, csv_path)
+            for image_identifier, csv_path in zip(image_identifiers, csv_paths)
+            if image_identifier not in modification_times
+            or (csv_path.exists() and modification_times[image_identifier] != _get_mtime(csv_path))
+        ]
+
+        if outdated:
+            self.import_csv_files(csv_path for _, csv_path in outdated)
+
+        boxes_by_identifier = self.get_many(image_identifiers)
+        return [boxes_by_identifier[image_identifier] for image_identifier in image_identifiers]
+
+    def import_csv_files(self, csv_paths: Iterable[AnyPath]):
+        """Import `annotation_<id>.csv` files into the store, in a single transaction.
+
+        :param csv_paths: Paths of the csv files.
+        """
+        annotations = [
+            (
+                get_image_identifier_from_csv(csv_path),
+                _read_boxes(csv_path),
+                _get_mtime(csv_path),
+            )
+            for csv_path in csv_paths
+        ]
+
+        with self.transaction() as connection:
+            for image_identifier, boxes, csv_mtime_ns in annotations:
+                self._put(connection, image_identifier, boxes, csv_mtime_ns)
+
+    def export_csv_files(
+        self, output_root: AnyPath, image_identifiers: Optional[Sequence[str]] = None
+    ):
+        """Export annotations as `annotation_<id>.csv` files.
+
+        :param output_root: Output folder.
+        :param image_identifiers: Image ids. If None, then all annotations are exported.
+        """
+        output_root = Path(output_root)
+        output_root.mkdir(exist_ok=True, parents=True)
+
+        if image_identifiers is None:
+            image_identifiers = [
+                row[0] for row in self.connection.execute("SELECT image_id FROM annotations")
+            ]
+
+        for image_identifier, boxes in self.get_many(image_identifiers).items():
+            boxes.to_csv(
+                output_root / f"annotation_{image_identifier}.csv", index=True, index_label="index"
+            )
+
+    def _get_modification_times(self, image_identifiers: Sequence[str]) -> Dict[str, int]:
+        modification_times = {}
+
+        for chunk in _chunks(list(image_identifiers), _MAX_PARAMETERS):
+            placeholders = ",".join("?" * len(chunk))
+            modification_times.update(
+                self.connection.execute(
+                    f"SELECT image_id, csv_mtime_ns FROM annotations WHERE image_id IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+            )
+
+        return modification_times
+
+    @staticmethod
+    def _put(
+        connection: sqlite3.Connection,
+        image_identifier: str,
+        boxes: List[List[float]],
+        csv_mtime_ns: Optional[int],
+    ):
+        connection.execute("DELETE FROM boxes WHERE image_id = ?", (image_identifier,))
+        connection.executemany(
+            "INSERT INTO boxes (image_id, box_index, x0, y0, x1, y1) VALUES (?, ?, ?, ?, ?, ?)",
+            [(image_identifier, index, *box) for index, box in enumerate(boxes)],
+        )
+        connection.execute(
+            "INSERT OR REPLACE INTO annotations (image_id, csv_mtime_ns) VALUES (?, ?)",
+            (image_identifier, csv_mtime_ns),
+        )
+
+
+def get_image_identifier_from_csv(csv_path: AnyPath) -> str:
+    """Retrieve image id based on the path of an annotation csv file (`annotation_<id>.csv`).
+
+    :param csv_path: Path of the csv file.
+    :return: image id
+    """
+    return Path(csv_path).stem[11:]
+
+
+def _read_boxes(csv_path: AnyPath) -> List[List[float]]:
+    """Read the boxes of a csv file, without the overhead of pandas. Rows with missing coordinates (empty or NaN
+    cells) are skipped.
+
+    :param csv_path: Path of the csv file.
+    :return: List of boxes [x0, y0, x1, y1].
+    """
+    boxes = []
+
+    with open(str(csv_path), newline="") as file:
+        for row in csv.DictReader(file):
+            try:
+                box = [float(row[column]) for column in BOX_COLUMNS]
+            except (KeyError, TypeError, ValueError):
+                continue
+
+            if not any(math.isnan(value) for value in box):
+                boxes.append(box)
+
+    return boxes
+
+
+def _get_mtime(path: AnyPath) -> int:
+    return os.stat(str(path)).st_mtime_ns
+
+
+def _chunks(items: list, chunk_size: int) -> Iterable[list]:
+    for start in range(0, len(items), chunk_size):
+        yield items[start : start + chunk_size]
+
+
+_annotation_store = None  # type: Optional[AnnotationStore]
+
+
+def get_annotation_store() -> AnnotationStore:
+    """Get the annotation store of the application.
+
+    :return: Annotation store.
+    """
+    global _annotation_store
+
+    if _annotation_store is None:
+        _annotation_store = AnnotationStore()
+
+    return _annotation_store
@@ -0,0 +1,190 @@
+"""Comparison of the masks, which two models predict for the same boxes (see README, "Deep-MAC versus Deep-MARC")."""
+
+import os
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from .custom_types import AnyPath
+from .data import get_pixel_bounds
+
+# The first model is the reference, i.e. deviations are calculated as `size_deepmarc - size_deepmac`.
+COMPARISON_MODEL_NAMES = ("deepmac", "deepmarc")
+
+# Sub folder of the results folder, where the comparison is stored.
+COMPARISON_FOLDER_NAME = "comparison"
+
+
+def compare_masks(
+    masks_reference: np.ndarray,
+    masks_other: np.ndarray,
+    boxes: pd.DataFrame,
+    threshold: float = 0.5,
+    chunk_size: int = 256,
+) -> pd.DataFrame:
+    """Compare the masks of two models, which were predicted for the same boxes.
+
+    Predicted masks are zero outside of their boxes, so the overlap of two masks is computed on crops of the boxes,
+    instead of the full images. Crops of similar size are stacked into chunks, so that the overlap of many instances
+    is computed at once.
+
+    :param masks_reference: Mask probabilities of the reference model [N, Y, X].
+    :param masks_other: Mask probabilities of the other model [N, Y, X].
+    :param boxes: Dataframe with columns ["x0", "y0", "x1", "y1"].
+    :param threshold: Threshold to binarize the masks.
+    :param chunk_size: Maximum number of instances per chunk.
+    :return: Dataframe with one row per instance and the columns ["iou", "area_reference", "area_other",
+        "area_ratio", "size_deviation_absolute", "size_deviation_relative"].
+    """
+    num_instances, height, width = masks_reference.shape
+
+    bounds = np.array(
+        [
+            get_pixel_bounds(box.x0, box.y0, box.x1, box.y1, height, width)
+            for box in boxes.itertuples(index=False)
+        ],
+        dtype=np.int64,
+    ).reshape(-1, 4)
+    crop_heights = bounds[:, 2] - bounds[:, 0]
+    crop_widths = bounds[:, 3] - bounds[:, 1]
+
+    intersections = np.zeros(num_instances)
+    areas_reference = np.zeros(num_instances)
+    areas_other = np.zeros(num_instances)
+
+    # Sort by size, to minimize the padding of the crops within a chunk.
+    order = np.argsort(crop_heights * crop_widths)
+
+    for chunk in np.array_split(order, max(1, int(np.ceil(num_instances / chunk_size)))):
+        if not len(chunk):
+            continue
+
+        chunk_shape = (len(chunk), crop_heights[chunk].max(), crop_widths[chunk].max())
+        crops_reference = np.zeros(chunk_shape, dtype=bool)
+        crops_other = np.zeros(chunk_shape, dtype=bool)
+
+        for crop_index, instance_index in enumerate(chunk):
+            y0, x0, y1, x1 = bounds[instance_index]
+            crops_reference[crop_index, : y1 - y0, : x1 - x0] = (
+                masks_reference[instance_index, y0:y1, x0:x1] > threshold
+            )
+            crops_other[crop_index, : y1 - y0, : x1 - x0] = (
+                masks_other[instance_index, y0:y1, x0:x1] > threshold
+            )
+
+        intersections[chunk] = np.count_nonzero(crops_reference & crops_other, axis=(1, 2))
+        areas_reference[chunk] = np.count_nonzero(crops_reference, axis=(1, 2))
+        areas_other[chunk] = np.count_nonzero(crops_other, axis=(1, 2))
+
+    unions = areas_reference + areas_other - intersections
+
+    # The square root of the area is used as measure for the size of an instance.
+    sizes_reference = np.sqrt(areas_reference)
+    sizes_other = np.sqrt(areas_other)
+    size_deviations_absolute = sizes_other - sizes_reference
+
+    return pd.DataFrame(
+        {
+            "iou": _safe_divide(intersections, unions),
+            "area_reference": areas_reference,
+            "area_other": areas_other,
+            "area_ratio": _safe_divide(areas_other, areas_reference),
+            "size_deviation_absolute": size_deviations_absolute,
+            "size_deviation_relative": _safe_divide(size_deviations_absolute, sizes_reference),
+        }
+    )
+
+
+def write_comparison(
+    comparison_root: AnyPath,
+    image_identifier: str,
+    masks_reference: np.ndarray,
+    masks_other: np.ndarray,
+    boxes: pd.DataFrame,
+):
+    """Compare the masks of two models for a single image and store the statistics as `comparison_<id>.csv`.
+
+    :param comparison_root: Output folder of the comparison.
+    :param image_identifier: Image id.
+    :param masks_reference: Mask probabilities of the reference model [N, Y, X].
+    :param masks_other: Mask probabilities of the other model [N, Y, X].
+    :param boxes: Dataframe with columns ["x0", "y0", "x1", "y1"].
+    """
+    comparison_root = Path(comparison_root)
+    sample_root = comparison_root / "samples"
+    sample_root.mkdir(exist_ok=True, parents=True)
+
+    statistics = compare_masks(masks_reference, masks_other, boxes)
+    statistics.insert(0, "image_id", image_identifier)
+
+    csv_path = sample_root / f"comparison_{image_identifier}.csv"
+    temporary_path = sample_root / f".comparison_{image_identifier}.partial.csv"
+    statistics.to_csv(temporary_path, index=True, index_label="index")
+    os.replace(str(temporary_path), str(csv_path))
+
+
+def summarize_comparison(
+    comparison_root: AnyPath, model_names: Sequence[str] = COMPARISON_MODEL_NAMES
+):
+    """Combine the statistics of all images into `comparison.csv`, and store a summary (`summary.csv`) and
+    histograms of the IoU and the size deviations.
+
+    :param comparison_root: Output folder of the comparison.
+    :param model_names: Names of the reference model and the other model.
+    """
+    comparison_root = Path(comparison_root)
+    csv_paths = sorted((comparison_root / "samples").glob("comparison_*.csv"))
+
+    if not csv_paths:
+        return
+
+    statistics = pd.concat([pd.read_csv(csv_path) for csv_path in csv_paths], ignore_index=True)
+    statistics = statistics.rename(
+        columns={
+            "area_reference": f"area_{model_names[0]}",
+            "area_other": f"area_{model_names[1]}",
+        }
+    )
+    statistics.to_csv(comparison_root / "comparison.csv", index=False)
+
+    summary = pd.DataFrame(
+        {
+            "num_instances": [len(statistics)],
+            "iou_median": [statistics["iou"].median()],
+            "iou_quantile_1": [statistics["iou"].quantile(0.01)],
+            "area_ratio_median": [statistics["area_ratio"].median()],
+            "size_deviation_absolute_median": [statistics["size_deviation_absolute"].median()],
+            "size_deviation_relative_median": [statistics["size_deviation_relative"].median()],
+        }
+    )
+    summary.to_csv(comparison_root / "summary.csv", index=False)
+
+    histograms = {
+        "iou": "IoU",
+        "size_deviation_absolute": f"size_{model_names[1]} - size_{model_names[0]} / px",
+        "size_deviation_relative": f"(size_{model_names[1]} - size_{model_names[0]}) / size_{model_names[0]}",
+    }
+
+    for column, label in histograms.items():
+        figure = Figure(figsize=(5, 4))
+        axes = figure.add_subplot(111)
+        axes.hist(statistics[column].dropna(), bins=50)
+        axes.set_xlabel(label)
+        axes.set_ylabel("Number of instances")
+        figure.tight_layout()
+        figure.savefig(str(comparison_root / f"{column}_histogram.svg"))
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Divide element-wise and return NaN, where the denominator is zero.
+
+    :param numerator: Numerator.
+    :param denominator: Denominator.
+    :return: Quotient.
+    """
+    quotient = np.full(numerator.shape, np.nan)
+    np.divide(numerator, denominator, out=quotient, where=denominator != 0)
+    return quotient
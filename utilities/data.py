@@ -1,20 +1,37 @@
+import functools
+import os
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
 import numpy as np
 import pandas as pd
-import tensorflow as tf
 from PIL import Image
 
 from .custom_types import AnyPath
+from .decoding import read_image_array, to_rgb8
+from .shared_state import get_shared_state
+
+# Formats that are stored as they are, when an image is moved to the `annotated` folder. Images in any other format
+# are converted to lossless png-files.
+SUPPORTED_IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".npy")
+
+# Key of the shared state, under which failed conversions are recorded (file name of the original image: error).
+CONVERSION_FAILURES_KEY = "conversion_failures"
 
+_conversion_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-conversion")
 
-def read_image(path: AnyPath) -> np.array:
-    """Read an image.
+
+def read_image(path: AnyPath, max_size: Optional[int] = None) -> np.array:
+    """Read an image as 8-bit RGB image. Decoded images are cached (see `utilities.decoding`).
 
     :param path: input path
+    :param max_size: If specified, the image is decoded at a reduced resolution, so that its longer side is at most
+        `max_size` pixels long.
     :return: image [Y, X, 3]
     """
-    with tf.io.gfile.GFile(path, "rb") as f:
-        image = Image.open(f).convert("RGB")
-        return np.array(image, dtype=np.uint8)
+    return to_rgb8(read_image_array(path, max_size))
 
 
 def sort_box_coordinates(boxes: pd.DataFrame):
@@ -28,3 +45,125 @@ def sort_box_coordinates(boxes: pd.DataFrame):
     boxes["x1"] = boxes_unsorted[["x0", "x1"]].max(axis=1)
     boxes["y0"] = boxes_unsorted[["y0", "y1"]].min(axis=1)
     boxes["y1"] = boxes_unsorted[["y0", "y1"]].max(axis=1)
+
+
+def is_supported_image(path: AnyPath) -> bool:
+    """Check if an image file is in a format that can be used without conversion.
+
+    :param path: path of the image
+    :return: True, if the image does not need to be converted, false, if not.
+    """
+    return Path(path).suffix.lower() in SUPPORTED_IMAGE_SUFFIXES
+
+
+def move_image(input_path: AnyPath, output_root: AnyPath, output_stem: str) -> Future:
+    """Move an image to a folder. Images in a supported format are just renamed, without decoding them. All other
+    images are moved to a hidden staging file and converted to png-files in the background.
+
+    :param input_path: path of the input image
+    :param output_root: folder, where the image is moved to
+    :param output_stem: file name of the output image, without suffix
+    :return: Future, which resolves to the final path of the image.
+    """
+    input_path = Path(input_path)
+    output_root = Path(output_root)
+
+    if is_supported_image(input_path):
+        output_path = output_root / f"{output_stem}{input_path.suffix.lower()}"
+        shutil.move(str(input_path), str(output_path))
+
+        future = Future()
+        future.set_result(output_path)
+        return future
+
+    # Hidden files are ignored when pairing images and csv files, so that a sample only becomes visible, once the
+    # conversion has finished.
+    staging_path = output_root / f".{output_stem}{input_path.suffix}"
+    shutil.move(str(input_path), str(staging_path))
+
+    future = _conversion_executor.submit(
+        _convert_to_png, staging_path, output_root / f"{output_stem}.png"
+    )
+    future.add_done_callback(
+        functools.partial(
+            _restore_on_failure,
+            staging_path,
+            output_root / f"{output_stem}{input_path.suffix.lower()}",
+        )
+    )
+    return future
+
+
+def _convert_to_png(staging_path: Path, output_path: Path) -> Path:
+    """Convert an image to a png-file and remove the original.
+
+    :param staging_path: path of the original image
+    :param output_path: path of the png-file
+    :return: path of the png-file
+    """
+    partial_path = staging_path.with_name(f"{staging_path.name}.partial.png")
+    try:
+        with Image.open(staging_path) as image:
+            image.save(partial_path)
+    except BaseException:
+        if partial_path.exists():
+            partial_path.unlink()
+        raise
+    os.replace(str(partial_path), str(output_path))
+    os.remove(str(staging_path))
+    return output_path
+
+
+def get_conversion_failures(root: AnyPath) -> Dict[str, str]:
+    """Get the images of a folder, which could not be converted to png-files and have been kept in their original
+    format.
+
+    :param root: Folder of the images.
+    :return: Error message by file name.
+    """
+    failures = get_shared_state().get(CONVERSION_FAILURES_KEY, {})
+    return {name: error for name, error in failures.items() if (Path(root) / name).exists()}
+
+
+def _restore_on_failure(staging_path: Path, visible_path: Path, future: Future):
+    """Report a failed conversion and give the staging file a visible name again. The image is then evaluated in its
+    original format, and the failure is shown on the evaluation page (see `get_conversion_failures`).
+
+    :param staging_path: path of the original image
+    :param visible_path: visible path of the original image
+    :param future: Future of the conversion
+    """
+    error = future.exception()
+    if error is None:
+        return
+
+    print(f"⚠️ Converting {visible_path.name} to png failed ({error}).", flush=True)
+    if staging_path.exists():
+        os.replace(str(staging_path), str(visible_path))
+        print(f"⚠️ The original image was kept as {visible_path}.", flush=True)
+
+    state = get_shared_state()
+    with state.transaction():
+        failures = state.get(CONVERSION_FAILURES_KEY, {})
+        failures[visible_path.name] = str(error)
+        state.set(CONVERSION_FAILURES_KEY, failures)
+
+
+def get_pixel_bounds(
+    x0: float, y0: float, x1: float, y1: float, height: int, width: int
+) -> Tuple[int, int, int, int]:
+    """Get the integer pixel bounds of a box, clipped to the image.
+
+    :param x0: x-coordinate of the first corner of the box.
+    :param y0: y-coordinate of the first corner of the box.
+    :param x1: x-coordinate of the second corner of the box.
+    :param y1: y-coordinate of the second corner of the box.
+    :param height: Height of the image.
+    :param width: Width of the image.
+    :return: Bounds (y0, x0, y1, x1), so that `image[y0:y1, x0:x1]` covers the box.
+    """
+    x_min = int(np.clip(np.floor(min(x0, x1)), 0, width))
+    x_max = int(np.clip(np.ceil(max(x0, x1)), 0, width))
+    y_min = int(np.clip(np.floor(min(y0, y1)), 0, height))
+    y_max = int(np.clip(np.ceil(max(y0, y1)), 0, height))
+    return y_min, x_min, y_max, x_max
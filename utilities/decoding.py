@@ -0,0 +1,225 @@
+"""Decoding of images, with support for reduced-resolution decoding (e.g. for display), memory-mapped access to
+uncompressed TIFF/NPY files and a cache of decoded images, which is shared by all parts of the application."""
+
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from .custom_types import AnyPath
+
+try:
+    import tifffile
+except ImportError:  # Memory-mapping of TIFF files is optional.
+    tifffile = None
+
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE_MB", 512)) * 1024**2
+
+# PIL modes, which are kept as they are, to not lose any information (e.g. of 16-bit micrographs).
+NATIVE_MODES = ("L", "RGB", "I;16", "I;16B", "I;16L", "I", "F")
+
+CacheKey = Tuple[str, int, Optional[int]]
+
+
+class ImageCache:
+    """Thread-safe LRU cache of decoded images, limited by the number of bytes of the cached images. Memory-mapped
+    images are not cached, since they hold a file descriptor and mapping them again is cheap."""
+
+    def __init__(self, max_bytes: int = IMAGE_CACHE_SIZE):
+        """
+        :param max_bytes: Maximum number of bytes of all cached images.
+        """
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()  # type: OrderedDict[CacheKey, Tuple[np.ndarray, int]]
+        self._num_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: CacheKey) -> Optional[np.ndarray]:
+        """Get a cached image.
+
+        :param key: Cache key of the image.
+        :return: Image or None, if the image is not cached.
+        """
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None:
+                return None
+            self._images.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: CacheKey, image: np.ndarray):
+        """Add an image to the cache and evict the least recently used images, if necessary.
+
+        :param key: Cache key of the image.
+        :param image: Image.
+        """
+        num_bytes = image.nbytes
+
+        if isinstance(image, np.memmap) or num_bytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._images:
+                self._num_bytes -= self._images.pop(key)[1]
+
+            self._images[key] = (image, num_bytes)
+            self._num_bytes += num_bytes
+
+            while self._num_bytes > self.max_bytes:
+                _, (_, evicted_num_bytes) = self._images.popitem(last=False)
+                self._num_bytes -= evicted_num_bytes
+
+    def clear(self):
+        """Remove all images from the cache."""
+        with self._lock:
+            self._images.clear()
+            self._num_bytes = 0
+
+
+IMAGE_CACHE = ImageCache()
+
+
+def read_image_array(path: AnyPath, max_size: Optional[int] = None) -> np.ndarray:
+    """Read an image in its native data type (e.g. 16-bit), using the shared image cache.
+
+    :param path: input path
+    :param max_size: If specified, the image is decoded at a reduced resolution, so that its longer side is at most
+        `max_size` pixels long. JPEG images are resized to exactly this size, all other images are reduced by integer
+        factors, so the longer side may end up shorter.
+    :return: image [Y, X] or [Y, X, C]. The array is read-only, since it may be shared or memory-mapped.
+    """
+    path = str(path)
+    key = (path, os.stat(path).st_mtime_ns, max_size)
+
+    image = IMAGE_CACHE.get(key)
+
+    if image is None:
+        image = _decode(path, max_size)
+        image.flags.writeable = False
+        IMAGE_CACHE.put(key, image)
+
+    return image
+
+
+def get_image_size(path: AnyPath) -> Tuple[int, int]:
+    """Get the size of an image, without decoding it.
+
+    :param path: input path
+    :return: height and width of the image
+    """
+    memory_map = _memory_map(str(path))
+
+    if memory_map is not None:
+        return memory_map.shape[0], memory_map.shape[1]
+
+    with tf.io.gfile.GFile(path, "rb") as f:
+        width, height = Image.open(f).size
+        return height, width
+
+
+def to_rgb8(image: np.ndarray) -> np.ndarray:
+    """Convert an image into an 8-bit RGB image. Images with a higher bit depth are rescaled to their value range.
+
+    :param image: image [Y, X] or [Y, X, C]
+    :return: image [Y, X, 3]
+    """
+    if image.ndim == 3 and image.shape[2] == 4:
+        image = image[..., :3]
+
+    if image.dtype != np.uint8:
+        image = image.astype(np.float32)
+        minimum = image.min()
+        value_range = max(float(image.max() - minimum), 1e-8)
+        image = ((image - minimum) * (255 / value_range)).round().astype(np.uint8)
+
+    if image.ndim == 2:
+        image = np.stack([image] * 3, axis=-1)
+    elif image.shape[2] == 1:
+        image = np.repeat(image, 3, axis=-1)
+
+    return np.ascontiguousarray(image)
+
+
+def _decode(path: str, max_size: Optional[int]) -> np.ndarray:
+    """Decode an image, using memory-mapping, if possible.
+
+    :param path: input path
+    :param max_size: maximum length of the longer side of the image
+    :return: image [Y, X] or [Y, X, C]
+    """
+    memory_map = _memory_map(path)
+
+    if memory_map is not None:
+        factor = _get_reduction_factor(memory_map.shape[:2], max_size)
+        if factor == 1:
+            return memory_map
+        # Strided access only touches the required pages of the file.
+        return np.ascontiguousarray(memory_map[::factor, ::factor])
+
+    with tf.io.gfile.GFile(path, "rb") as f:
+        image = Image.open(f)
+
+        is_jpeg = image.format == "JPEG"
+
+        if max_size is not None and is_jpeg:
+            # Let the JPEG decoder skip the high frequencies, instead of decoding the full image.
+            scale = max_size / max(image.size)
+            if scale < 1:
+                image.draft(image.mode, (int(image.width * scale), int(image.height * scale)))
+
+        if image.mode not in NATIVE_MODES:
+            image = image.convert("RGB")
+
+        if max_size is not None and is_jpeg:
+            # The decoder only scales by powers of two, so the drafted image is resized to the requested size.
+            # Reducing it by another integer factor would shrink it to as little as half of `max_size`.
+            scale = max_size / max(image.size)
+            if scale < 1:
+                image = image.resize(
+                    (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+                )
+        else:
+            factor = _get_reduction_factor((image.height, image.width), max_size)
+            if factor > 1:
+                image = image.reduce(factor)
+
+        return np.array(image)
+
+
+def _memory_map(path: str) -> Optional[np.ndarray]:
+    """Memory-map an uncompressed TIFF or NPY file.
+
+    :param path: input path
+    :return: memory-mapped image or None, if the file cannot be memory-mapped.
+    """
+    suffix = Path(path).suffix.lower()
+
+    if suffix == ".npy":
+        return np.load(path, mmap_mode="r")
+
+    if suffix in (".tif", ".tiff") and tifffile is not None:
+        try:
+            return tifffile.memmap(path, mode="r")
+        except ValueError:  # compressed or non-contiguous TIFF
+            return None
+
+    return None
+
+
+def _get_reduction_factor(shape: Tuple[int, int], max_size: Optional[int]) -> int:
+    """Get the smallest integer factor, by which an image needs to be reduced, so that its longer side is at most
+    `max_size` pixels long.
+
+    :param shape: height and width of the image
+    :param max_size: maximum length of the longer side of the image
+    :return: reduction factor
+    """
+    if max_size is None:
+        return 1
+
+    return max(1, -(-max(shape) // max_size))
@@ -0,0 +1,142 @@
+"""In-process inference with the SavedModels of the model server, without the round trip through its REST API.
+
+The models are loaded from the paths in `models.config`. If the environment variable `MODEL_ROOT` is set, then the
+models are loaded from `<MODEL_ROOT>/<model_name>` instead (e.g. if the models have been copied out of the model
+image). Like TF Serving, the highest numbered version folder of a model is used.
+"""
+
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import tensorflow as tf
+
+MODEL_CONFIG_PATH = Path(
+    os.getenv("MODEL_CONFIG_PATH", Path(__file__).parents[1] / "models.config")
+)
+MODEL_ROOT = os.getenv("MODEL_ROOT", "")
+
+# Number of threads, which TensorFlow uses within and across operations (0: chosen by TensorFlow).
+INFERENCE_INTRA_OP_THREADS = int(os.getenv("INFERENCE_INTRA_OP_THREADS", 0))
+INFERENCE_INTER_OP_THREADS = int(os.getenv("INFERENCE_INTER_OP_THREADS", 0))
+
+# Maximum number of predictions, which run at the same time. Concurrent predictions compete for the same threads.
+INFERENCE_MAX_CONCURRENCY = int(os.getenv("INFERENCE_MAX_CONCURRENCY", 1))
+
+SIGNATURE_NAME = "serving_default"
+
+_runner = None  # type: Optional[EmbeddedModelRunner]
+_runner_lock = threading.Lock()
+
+
+def read_model_base_paths(config_path: Path = MODEL_CONFIG_PATH) -> Dict[str, Path]:
+    """Read the base paths of the models from a TF Serving model config file.
+
+    :param config_path: Path of the model config file.
+    :return: Base path of each model, by model name.
+    """
+    config = config_path.read_text()
+    names = re.findall(r"name:\s*'([^']+)'", config)
+    base_paths = re.findall(r"base_path:\s*'([^']+)'", config)
+    return {name: Path(base_path) for name, base_path in zip(names, base_paths)}
+
+
+def get_latest_version_path(base_path: Path) -> Path:
+    """Get the folder of the latest version of a model.
+
+    :param base_path: Base path of the model, with one sub folder per version.
+    :return: Folder of the SavedModel with the highest version number.
+    """
+    versions = [path for path in base_path.iterdir() if path.is_dir() and path.name.isdigit()]
+
+    if not versions:
+        raise FileNotFoundError(f"There is no version of the model in {base_path}.")
+
+    return max(versions, key=lambda path: int(path.name))
+
+
+class EmbeddedModelRunner:
+    """Thread-safe runner for the `serving_default` signatures of SavedModels. Models are loaded on first use."""
+
+    def __init__(
+        self, model_base_paths: Dict[str, Path], max_concurrency: int = INFERENCE_MAX_CONCURRENCY
+    ):
+        """
+        :param model_base_paths: Base path of each model, by model name.
+        :param max_concurrency: Maximum number of predictions, which run at the same time.
+        """
+        self.model_base_paths = model_base_paths
+        self._models = {}  # type: Dict[str, tf.Module]
+        self._signatures = {}  # type: Dict[str, Callable]
+        self._load_lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+
+    def predict(self, model_name: str, inputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """Run the `serving_default` signature of a model.
+
+        :param model_name: Name of the model.
+        :param inputs: Input tensors by name. They are cast to the data types of the signature.
+        :return: Output tensors by name.
+        """
+        signature = self._get_signature(model_name)
+        input_specs = signature.structured_input_signature[1]
+
+        tensors = {
+            name: tf.convert_to_tensor(value, dtype=input_specs[name].dtype)
+            for name, value in inputs.items()
+        }
+
+        with self._semaphore:
+            outputs = signature(**tensors)
+
+        return {name: output.numpy() for name, output in outputs.items()}
+
+    def _get_signature(self, model_name: str) -> Callable:
+        with self._load_lock:
+            if model_name not in self._signatures:
+                if model_name not in self.model_base_paths:
+                    raise ValueError(f"Unknown model name: {model_name}")
+
+                model_path = get_latest_version_path(self.model_base_paths[model_name])
+                print(f"📦 Loading {model_name} from {model_path}...", flush=True)
+
+                # Keep a reference to the model, since the signature does not keep its variables alive.
+                self._models[model_name] = tf.saved_model.load(str(model_path))
+                self._signatures[model_name] = self._models[model_name].signatures[SIGNATURE_NAME]
+
+            return self._signatures[model_name]
+
+
+def get_runner() -> EmbeddedModelRunner:
+    """Get the shared runner. It is created on first use.
+
+    :return: Shared runner.
+    """
+    global _runner
+
+    with _runner_lock:
+        if _runner is None:
+            configure_threads()
+
+            model_base_paths = read_model_base_paths()
+            if MODEL_ROOT:
+                model_base_paths = {name: Path(MODEL_ROOT) / name for name in model_base_paths}
+
+            _runner = EmbeddedModelRunner(model_base_paths)
+
+    return _runner
+
+
+def configure_threads():
+    """Set the number of threads of TensorFlow. This only has an effect before TensorFlow executes its first
+    operation."""
+    try:
+        if INFERENCE_INTRA_OP_THREADS:
+            tf.config.threading.set_intra_op_parallelism_threads(INFERENCE_INTRA_OP_THREADS)
+        if INFERENCE_INTER_OP_THREADS:
+            tf.config.threading.set_inter_op_parallelism_threads(INFERENCE_INTER_OP_THREADS)
+    except RuntimeError:  # TensorFlow has already been initialized.
+        print("⚠️ The number of inference threads could not be set anymore.", flush=True)
@@ -0,0 +1,614 @@
+"""Evaluation of annotated samples, independent of the user interface (used by the evaluation app and `evaluate.py`).
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .annotation_store import get_annotation_store, get_image_identifier_from_csv
+from .comparison import COMPARISON_FOLDER_NAME, summarize_comparison, write_comparison
+from .custom_types import AnyPath
+from .data import read_image
+from .labels import get_label_image, write_label_image
+from .mask_archive import MaskArchive, crop_masks, paste_masks, write_mask_archive
+from .mask_png import MaskEncodingStats, write_mask_pngs
+from .measurement import MEASUREMENT_FOLDER_NAME, consolidate_measurements, write_measurements
+from .paths import ANNOTATED_ROOT, RESULTS_ROOT
+from .prediction import predict_masks
+from .visualization import visualize_annotation
+
+# Comma-separated list of formats, in which the masks are stored:
+#   png: one 1-bit png-file per instance (`masks/mask_<id>_<index>.png`), see `utilities.mask_png`
+#   npz: one compressed archive per image with all masks, cropped to their boxes (`masks/masks_<id>.npz`), see
+#        `utilities.mask_archive`
+#   labels: one label image per image, in which overlaps are resolved by mask probability (`labels_<id>.png`, or
+#           `labels_<id>.tif` for more than 65535 instances), see `utilities.labels`
+MASK_OUTPUT_FORMATS = [
+    output_format.strip().lower()
+    for output_format in os.getenv("MASK_OUTPUT_FORMATS", "png").split(",")
+]
+
+# Hidden folder within the output folder of a model, where the journals of samples are kept during the evaluation.
+JOURNAL_FOLDER_NAME = ".journal"
+
+# Function, which is called with the number of evaluated samples, after each sample.
+ProgressCallback = Callable[[int], None]
+
+_pairs_cache = {}  # type: Dict[str, Tuple[int, Tuple[List[str], List[str]]]]
+_pairs_cache_lock = threading.Lock()
+
+
+class EvaluationSummary(NamedTuple):
+    num_samples: int
+    num_instances: int
+    duration: float  # total wall time in seconds
+    duration_decoding: float  # summed time in seconds, spent per stage
+    duration_prediction: float
+    duration_encoding: float
+    mask_encoding: MaskEncodingStats  # summed over all samples
+
+    def __str__(self) -> str:
+        duration = max(self.duration, 1e-9)
+        summary = (
+            f"Evaluated {self.num_samples} samples with {self.num_instances} instances in {self.duration:.1f} s "
+            f"({self.num_samples / duration:.2f} samples/s, {self.num_instances / duration:.1f} instances/s).\n"
+            f"Summed time per stage: decoding {self.duration_decoding:.1f} s, "
+            f"prediction {self.duration_prediction:.1f} s, encoding {self.duration_encoding:.1f} s."
+        )
+
+        if self.mask_encoding.num_masks:
+            mask_duration = max(self.mask_encoding.duration, 1e-9)
+            summary += (
+                f"\nEncoded {self.mask_encoding.num_masks} mask png-files "
+                f"({self.mask_encoding.num_bytes / 1024 ** 2:.1f} MB) in {self.mask_encoding.duration:.1f} s "
+                f"({self.mask_encoding.num_masks / mask_duration:.1f} masks/s, "
+                f"{self.mask_encoding.num_bytes / 1024 ** 2 / mask_duration:.1f} MB/s)."
+            )
+
+        return summary
+
+
+class _SampleResult(NamedTuple):
+    num_instances: int
+    duration_decoding: float
+    duration_prediction: float
+    duration_encoding: float
+    mask_encoding: MaskEncodingStats
+
+
+class SampleJournal:
+    """Journal of the evaluation of a single sample, which allows to resume an interrupted evaluation.
+
+    The journal is a folder, which contains a state file, the predicted masks and the outputs of the sample, before
+    they are renamed into place.
+    """
+
+    PREDICTED = "predicted"  # The masks have been predicted and stored in the journal.
+    COMMITTED = "committed"  # The outputs have been renamed into place.
+
+    def __init__(self, root: AnyPath):
+        """
+        :param root: Folder of the journal.
+        """
+        self.root = Path(root)
+        self.output_root = self.root / "outputs"
+        self._state_path = self.root / "journal.json"
+        self._masks_path = self.root / "masks.npz"
+
+    @property
+    def state(self) -> Optional[str]:
+        """Last completed step of the evaluation or None, if no step has been completed."""
+        return self._read_state().get("state")
+
+    @property
+    def num_instances(self) -> int:
+        """Number of predicted instances."""
+        return self._read_state().get("num_instances", 0)
+
+    @property
+    def input_paths(self) -> Tuple[Optional[str], Optional[str]]:
+        """Paths of the image and the csv file of the sample."""
+        state = self._read_state()
+        return state.get("image_path"), state.get("csv_path")
+
+    @property
+    def model_results_roots(self) -> List[str]:
+        """Output folders of all models, the sample is evaluated with."""
+        return self._read_state().get("model_results_roots", [str(self.root.parent.parent)])
+
+    def has_pending_inputs(self) -> bool:
+        """Check if the inputs of the sample have not yet been moved to the results folder.
+
+        :return: True, if any of the inputs still exists, false, if not.
+        """
+        return any(path is not None and Path(path).exists() for path in self.input_paths)
+
+    def reset(self):
+        """Remove all contents of the journal."""
+        self.remove()
+        self.root.mkdir(parents=True)
+
+    def save_masks(
+        self,
+        masks: np.ndarray,
+        boxes: pd.DataFrame,
+        image_path: AnyPath,
+        csv_path: AnyPath,
+        model_results_roots: Sequence[AnyPath],
+    ):
+        """Store the predicted masks of the sample. Only what is needed to resume is stored: the binarized masks,
+        cropped to their boxes and compressed (see `utilities.mask_archive`).
+
+        :param masks: Mask probabilities [N, Y, X].
+        :param boxes: Dataframe with columns ["x0", "y0", "x1", "y1"].
+        :param image_path: Path of the image.
+        :param csv_path: Path of the annotation csv file.
+        :param model_results_roots: Output folders of all models, the sample is evaluated with.
+        """
+        temporary_path = self.root / "masks.partial.npz"
+        write_mask_archive(str(temporary_path), masks, boxes)
+        os.replace(str(temporary_path), str(self._masks_path))
+
+        self._write_state(
+            state=self.PREDICTED,
+            image_path=str(image_path),
+            csv_path=str(csv_path),
+            model_results_roots=[
+                str(model_results_root) for model_results_root in model_results_roots
+            ],
+            num_instances=len(masks),
+        )
+
+    def load_masks(self) -> np.ndarray:
+        """Load the predicted masks of the sample.
+
+        :return: Binarized masks [N, Y, X] (0 or 1).
+        """
+        with MaskArchive(self._masks_path) as archive:
+            return archive.get_masks().astype(np.float32)
+
+    def clear_outputs(self):
+        """Remove outputs of a previous, interrupted attempt to write the outputs."""
+        shutil.rmtree(str(self.output_root), ignore_errors=True)
+        self.output_root.mkdir()
+
+    def commit_outputs(self, model_results_root: AnyPath):
+        """Rename the outputs into place. Since the outputs are in the same file system as the results folder, each
+        rename is atomic.
+
+        :param model_results_root: Output folder of the model.
+        """
+        model_results_root = Path(model_results_root)
+
+        for directory, _, file_names in os.walk(str(self.output_root)):
+            target_directory = model_results_root / Path(directory).relative_to(self.output_root)
+            target_directory.mkdir(exist_ok=True, parents=True)
+
+            for file_name in file_names:
+                os.replace(os.path.join(directory, file_name), str(target_directory / file_name))
+
+        self._write_state(state=self.COMMITTED)
+
+    def remove(self):
+        """Remove the journal."""
+        shutil.rmtree(str(self.root), ignore_errors=True)
+
+    def _read_state(self) -> Dict:
+        try:
+            with open(str(self._state_path)) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_state(self, **changes):
+        state = self._read_state()
+        state.update(changes)
+
+        temporary_path = self.root / "journal.partial.json"
+        with open(str(temporary_path), "w") as file:
+            json.dump(state, file)
+        os.replace(str(temporary_path), str(self._state_path))
+
+
+def gather_image_and_csv_paths(root: AnyPath = ANNOTATED_ROOT) -> Tuple[List[str], List[str]]:
+    """Gather pairs of images and csv annotation files. The result is cached until the modification time of the
+    folder changes.
+
+    :param root: Folder with images and csv annotation files.
+    :return: List of image paths and list of csv paths.
+    """
+    root = str(root)
+
+    try:
+        modification_time = os.stat(root).st_mtime_ns
+    except FileNotFoundError:
+        return [], []
+
+    with _pairs_cache_lock:
+        cached = _pairs_cache.get(root)
+        if cached is not None and cached[0] == modification_time:
+            image_paths, csv_paths = cached[1]
+            return list(image_paths), list(csv_paths)
+
+    image_paths, csv_paths = _scan_image_and_csv_paths(root)
+
+    with _pairs_cache_lock:
+        _pairs_cache[root] = (modification_time, (image_paths, csv_paths))
+
+    return list(image_paths), list(csv_paths)
+
+
+def _scan_image_and_csv_paths(root: str) -> Tuple[List[str], List[str]]:
+    """Gather pairs of images and csv annotation files, using a single scan of a folder.
+
+    :param root: Folder with images and csv annotation files.
+    :return: List of image paths and list of csv paths.
+    """
+    image_paths_by_identifier = defaultdict(list)
+    csv_paths_by_identifier = {}
+
+    for entry in os.scandir(root):
+        name = entry.name
+        if name.startswith("annotation_") and name.endswith(".csv"):
+            csv_paths_by_identifier[name[11:-4]] = entry.path
+        # Images in any format are paired, e.g. images, whose conversion to png failed (see `utilities.data`).
+        elif name.startswith("image_"):
+            image_paths_by_identifier[os.path.splitext(name)[0][6:]].append(entry.path)
+
+    image_paths = []
+    csv_paths = []
+
+    for image_identifier, csv_path in csv_paths_by_identifier.items():
+        new_image_paths = image_paths_by_identifier.get(image_identifier, [])
+
+        # skip samples, where there is no 1:1 pair of csv and image files
+        if len(new_image_paths) != 1:
+            continue
+
+        image_paths.append(new_image_paths[0])
+        csv_paths.append(csv_path)
+
+    return image_paths, csv_paths
+
+
+def write_outputs(
+    image_identifier: str,
+    image: np.ndarray,
+    boxes: pd.DataFrame,
+    masks: np.ndarray,
+    model_results_root: AnyPath,
+    mask_output_formats: Sequence[str] = MASK_OUTPUT_FORMATS,
+) -> MaskEncodingStats:
+    """Write masks, morphology measurements and visualization of a sample.
+
+    :param image_identifier: Image id.
+    :param image: Image [Y, X, 3].
+    :param boxes: Dataframe with columns ["x0", "y0", "x1", "y1"].
+    :param masks: Mask probabilities [N, Y, X].
+    :param model_results_root: Output folder of the model.
+    :param mask_output_formats: Formats in which the masks are stored (see `MASK_OUTPUT_FORMATS`).
+    :return: Statistics of the encoding of the mask png-files.
+    """
+    model_results_root = Path(model_results_root)
+
+    mask_root = model_results_root / "masks"
+    mask_root.mkdir(exist_ok=True, parents=True)
+
+    mask_encoding = MaskEncodingStats(0, 0, 0.0)
+    if "png" in mask_output_formats:
+        mask_encoding = write_mask_pngs(mask_root, image_identifier, masks, boxes)
+
+    if "npz" in mask_output_formats:
+        write_mask_archive(mask_root / f"masks_{image_identifier}.npz", masks, boxes)
+
+    labels = get_label_image(masks)
+
+    if "labels" in mask_output_formats:
+        write_label_image(model_results_root, image_identifier, labels)
+
+    write_measurements(
+        model_results_root / MEASUREMENT_FOLDER_NAME, image_identifier, masks, labels
+    )
+
+    visualization_path = model_results_root / f"visualization_{image_identifier}.png"
+    visualization = visualize_annotation(image, masks, boxes)
+    visualization.save(visualization_path)
+
+    return mask_encoding
+
+
+def _write_outputs_from_crops(
+    image_identifier: str,
+    image: np.ndarray,
+    boxes: pd.DataFrame,
+    cropped_masks: Tuple[List[np.ndarray], np.ndarray],
+    model_results_root: AnyPath,
+) -> MaskEncodingStats:
+    """Write the outputs of a sample (see `write_outputs`), whose masks have been cropped to their boxes.
+
+    :param image_identifier: Image id.
+    :param image: Image [Y, X, 3].
+    :param boxes: Dataframe with columns ["x0", "y0", "x1", "y1"].
+    :param cropped_masks: Cropped mask probabilities and their bounds (see `utilities.mask_archive.crop_masks`).
+    :param model_results_root: Output folder of the model.
+    :return: Statistics of the encoding of the mask png-files.
+    """
+    masks = paste_masks(*cropped_masks, image.shape[:2])
+    return write_outputs(image_identifier, image, boxes, masks, model_results_root)
+
+
+def move_inputs(image_path: AnyPath, csv_path: AnyPath, model_results_roots: Sequence[AnyPath]):
+    """Move the image and the csv file of an evaluated sample to the output folders of the models. The files are
+    copied to all but the last output folder and then moved to the last one. Files that have already been moved (e.g.
+    by an interrupted evaluation) are skipped.
+
+    :param image_path: Path of the image.
+    :param csv_path: Path of the annotation csv file.
+    :param model_results_roots: Output folders of the models.
+    """
+    model_results_roots = [Path(model_results_root) for model_results_root in model_results_roots]
+
+    for path in (Path(image_path), Path(csv_path)):
+        if not path.exists():
+            continue
+
+        for model_results_root in model_results_roots[:-1]:
+            shutil.copy2(str(path), str(model_results_root / path.name))
+
+        shutil.move(str(path), str(model_results_roots[-1] / path.name))
+
+
+def evaluate_samples(
+    image_paths: Sequence[AnyPath],
+    csv_paths: Sequence[AnyPath],
+    model_names: Sequence[str],
+    results_root: AnyPath = RESULTS_ROOT,
+    num_processes: int = 0,
+    num_concurrent_requests: int = 1,
+    on_progress: Optional[ProgressCallback] = None,
+) -> EvaluationSummary:
+    """Predict masks for annotated samples, write the results and move the samples to the results folder.
+
+    The evaluation is crash-safe and can be resumed (see `evaluate_sample`). If two models are specified, then their
+    masks are compared (see `utilities.comparison`). The morphology measurements of all samples are combined into
+    `<results_root>/<model_name>/measurements.csv` (see `utilities.measurement`).
+
+    :param image_paths: List of input image paths.
+    :param csv_paths: List of annotation csv paths.
+    :param model_names: Names of the models to use for the evaluation ("deepmarc" and/or "deepmac").
+    :param results_root: Results folder. The results of each model are placed in a sub folder.
+    :param num_processes: Number of processes for decoding images and encoding results. If 0, then decoding and
+        encoding take place in the thread of the respective sample.
+    :param num_concurrent_requests: Number of samples, which are processed (and sent to the model) concurrently.
+    :param on_progress: Function, which is called with the number of evaluated samples, after each sample.
+    :return: Summary of the evaluation.
+    """
+    results_root = Path(results_root)
+
+    for model_name in model_names:
+        model_results_root = results_root / model_name
+        model_results_root.mkdir(exist_ok=True, parents=True)
+        clean_up_journal(model_results_root)
+
+    # Read the boxes of all samples at once.
+    all_boxes = get_annotation_store().load_csv_files(csv_paths)
+
+    process_pool = ProcessPoolExecutor(num_processes) if num_processes > 0 else None
+
+    start = time.perf_counter()
+    results = []
+
+    try:
+        with ThreadPoolExecutor(max(1, num_concurrent_requests)) as thread_pool:
+            futures = [
+                thread_pool.submit(
+                    evaluate_sample,
+                    image_path,
+                    csv_path,
+                    model_names,
+                    results_root,
+                    process_pool,
+                    boxes,
+                )
+                for image_path, csv_path, boxes in zip(image_paths, csv_paths, all_boxes)
+            ]
+
+            for future in futures:
+                results.append(future.result())
+                if on_progress is not None:
+                    on_progress(len(results))
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown()
+
+    for model_name in model_names:
+        consolidate_measurements(results_root / model_name)
+
+    if len(model_names) == 2:
+        summarize_comparison(results_root / COMPARISON_FOLDER_NAME, model_names)
+
+    return EvaluationSummary(
+        num_samples=len(results),
+        num_instances=sum(result.num_instances for result in results),
+        duration=time.perf_counter() - start,
+        duration_decoding=sum(result.duration_decoding for result in results),
+        duration_prediction=sum(result.duration_prediction for result in results),
+        duration_encoding=sum(result.duration_encoding for result in results),
+        mask_encoding=_sum_mask_encodings([result.mask_encoding for result in results]),
+    )
+
+
+def evaluate_sample(
+    image_path: AnyPath,
+    csv_path: AnyPath,
+    model_names: Sequence[str],
+    results_root: AnyPath = RESULTS_ROOT,
+    executor: Optional[Executor] = None,
+    boxes: Optional[pd.DataFrame] = None,
+) -> _SampleResult:
+    """Predict the masks of a sample, write the results and move the sample to the results folder.
+
+    For every model, the sample is journaled in `<results_root>/<model_name>/.journal/<id>`:
+        1. The predicted masks are stored in the journal, before any output is written.
+        2. All outputs are written into the journal and then renamed into place.
+    Afterwards, the masks of two models are compared, if two models are specified. Finally, the image and the csv file
+    are moved to the results folder. If the evaluation is interrupted, a restarted evaluation resumes from the last
+    completed step, without repeating the prediction. Since the journal only keeps binarized masks, overlaps in the
+    label image of a resumed sample are resolved by instance index instead of mask probability.
+
+    :param image_path: Path of the image.
+    :param csv_path: Path of the annotation csv file.
+    :param model_names: Names of the models to use for the evaluation ("deepmarc" and/or "deepmac").
+    :param results_root: Results folder. The results of each model are placed in a sub folder.
+    :param executor: Executor for decoding and encoding. If None, then decoding and encoding take place in the
+        current thread.
+    :param boxes: Dataframe with columns ["x0", "y0", "x1", "y1"]. If None, then the boxes are read from the
+        annotation store.
+    :return: Number of instances and the time spent per stage.
+    """
+    results_root = Path(results_root)
+    image_identifier = get_image_identifier_from_csv(csv_path)
+    model_results_roots = [results_root / model_name for model_name in model_names]
+    is_comparison = len(model_names) == 2
+
+    image = None
+    all_masks = []
+    num_instances = 0
+    duration_decoding = duration_prediction = duration_encoding = 0.0
+    mask_encodings = []
+
+    for model_name, model_results_root in zip(model_names, model_results_roots):
+        journal = SampleJournal(model_results_root / JOURNAL_FOLDER_NAME / image_identifier)
+        state = journal.state
+
+        if state == SampleJournal.COMMITTED and not is_comparison:
+            num_instances = journal.num_instances
+            continue
+
+        if image is None:
+            start = time.perf_counter()
+            image = _run(executor, read_image, image_path)
+            if boxes is None:
+                boxes = get_annotation_store().load_csv(csv_path)
+            duration_decoding += time.perf_counter() - start
+
+        start = time.perf_counter()
+        if state in (SampleJournal.PREDICTED, SampleJournal.COMMITTED):
+            masks = journal.load_masks()
+        else:
+            journal.reset()
+            masks = predict_masks(image, boxes, model_name)
+            journal.save_masks(masks, boxes, image_path, csv_path, model_results_roots)
+        duration_prediction += time.perf_counter() - start
+
+        if state != SampleJournal.COMMITTED:
+            start = time.perf_counter()
+            journal.clear_outputs()
+            if executor is None:
+                mask_encoding = write_outputs(
+                    image_identifier, image, boxes, masks, journal.output_root
+                )
+            else:
+                # Only send the masks within their boxes to the worker process, instead of pickling the full masks.
+                mask_encoding = _run(
+                    executor,
+                    _write_outputs_from_crops,
+                    image_identifier,
+                    image,
+                    boxes,
+                    crop_masks(masks, boxes),
+                    journal.output_root,
+                )
+            mask_encodings.append(mask_encoding)
+            journal.commit_outputs(model_results_root)
+            duration_encoding += time.perf_counter() - start
+
+        all_masks.append(masks)
+        num_instances = len(masks)
+
+    start = time.perf_counter()
+
+    if is_comparison:
+        write_comparison(results_root / COMPARISON_FOLDER_NAME, image_identifier, *all_masks, boxes)
+
+    move_inputs(image_path, csv_path, model_results_roots)
+
+    for model_results_root in model_results_roots:
+        SampleJournal(model_results_root / JOURNAL_FOLDER_NAME / image_identifier).remove()
+
+    duration_encoding += time.perf_counter() - start
+
+    return _SampleResult(
+        num_instances,
+        duration_decoding,
+        duration_prediction,
+        duration_encoding,
+        _sum_mask_encodings(mask_encodings),
+    )
+
+
+def clean_up_journal(model_results_root: AnyPath):
+    """Complete samples, which were interrupted while moving their inputs, and remove journals of samples, whose
+    inputs are no longer available (e.g. because they have been moved to the results folder, before the journal could
+    be removed).
+
+    :param model_results_root: Output folder of the model.
+    """
+    journal_root = Path(model_results_root) / JOURNAL_FOLDER_NAME
+
+    if not journal_root.is_dir():
+        return
+
+    for journal_path in journal_root.iterdir():
+        journal = SampleJournal(journal_path)
+        image_path, csv_path = journal.input_paths
+
+        # Inputs are only moved, once all outputs have been committed. If one of them is already gone, then the move
+        # was interrupted and needs to be completed. Otherwise, a lone image or csv file would be left behind, which
+        # is never paired again.
+        is_move_interrupted = journal.has_pending_inputs() and not all(
+            Path(path).exists() for path in (image_path, csv_path)
+        )
+
+        if journal.state == SampleJournal.COMMITTED and is_move_interrupted:
+            move_inputs(image_path, csv_path, journal.model_results_roots)
+
+        if not journal.has_pending_inputs():
+            journal.remove()
+
+
+def _sum_mask_encodings(mask_encodings: Sequence[MaskEncodingStats]) -> MaskEncodingStats:
+    """Sum the statistics of several mask encodings.
+
+    :param mask_encodings: Statistics of the mask encodings.
+    :return: Summed statistics.
+    """
+    return MaskEncodingStats(
+        sum(stats.num_masks for stats in mask_encodings),
+        sum(stats.num_bytes for stats in mask_encodings),
+        sum(stats.duration for stats in mask_encodings),
+    )
+
+
+def _run(executor: Optional[Executor], function: Callable, *args):
+    """Run a function in an executor and wait for its result, or run it directly, if there is no executor.
+
+    :param executor: Executor or None.
+    :param function: Function to run.
+    :param args: Arguments of the function.
+    :return: Return value of the function.
+    """
+    if executor is None:
+        return function(*args)
+
+    future = executor.submit(function, *args)  # type: Future
+    return future.result()
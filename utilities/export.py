@@ -0,0 +1,132 @@
+"""Export of the results of a model as zip archive, which is streamed while it is built, so that neither the whole
+archive has to be kept in memory nor a temporary archive has to be written to disk."""
+
+import io
+import os
+import re
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+from .custom_types import AnyPath
+
+# Number of bytes, which are read from a file at once.
+CHUNK_SIZE = 1024**2
+
+# Files in these formats are already compressed, so they are stored without compressing them again.
+COMPRESSED_SUFFIXES = (".png", ".jpg", ".jpeg", ".npz", ".svg.gz")
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Unseekable file, which collects written data, until it is taken out."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []  # type: List[bytes]
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        """Take out all data, which has been written since the last call.
+
+        :return: Written data.
+        """
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def gather_result_files(
+    model_results_root: AnyPath, image_identifiers: Optional[Iterable[str]] = None
+) -> List[Path]:
+    """Gather the result files of a model (visualizations, masks, label images, measurements, images and csv files).
+
+    :param model_results_root: Output folder of the model.
+    :param image_identifiers: Image ids. If None, then all files are gathered, including files, which summarize all
+        images (e.g. `measurements.csv`).
+    :return: Sorted list of file paths.
+    """
+    model_results_root = Path(model_results_root)
+
+    if image_identifiers is None:
+        paths = []
+        for directory, directory_names, file_names in os.walk(str(model_results_root)):
+            # Skip hidden folders, e.g. the journal of a running evaluation.
+            directory_names[:] = [name for name in directory_names if not name.startswith(".")]
+            paths += [Path(directory) / name for name in file_names if not name.startswith(".")]
+        return sorted(paths)
+
+    file_names = {
+        path.relative_to(model_results_root).as_posix(): path
+        for path in _list_files(model_results_root)
+    }
+    paths = []
+
+    for image_identifier in image_identifiers:
+        identifier = re.escape(image_identifier)
+        pattern = re.compile(
+            rf"((visualization|image|labels)_{identifier}\.\w+"
+            rf"|annotation_{identifier}\.csv"
+            rf"|masks/mask_{identifier}_\d+\.png"
+            rf"|masks/masks_{identifier}\.npz"
+            rf"|measurements/measurements_{identifier}\.csv)"
+        )
+        paths += [path for name, path in file_names.items() if pattern.fullmatch(name)]
+
+    return sorted(set(paths))
+
+
+def iter_zip(
+    root: AnyPath, paths: Iterable[AnyPath], chunk_size: int = CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Build a zip archive of files and yield it piece by piece.
+
+    :param root: Folder, relative to which the files are named in the archive.
+    :param paths: Paths of the files.
+    :param chunk_size: Number of bytes, which are read from a file at once.
+    :return: Iterator over the data of the archive.
+    """
+    root = Path(root)
+    buffer = _StreamBuffer()
+
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for path in paths:
+            path = Path(path)
+            info = zipfile.ZipInfo.from_file(str(path), path.relative_to(root).as_posix())
+            info.compress_type = (
+                zipfile.ZIP_STORED
+                if path.name.lower().endswith(COMPRESSED_SUFFIXES)
+                else zipfile.ZIP_DEFLATED
+            )
+
+            with open(str(path), "rb") as file, archive.open(
+                info, "w", force_zip64=info.file_size >= zipfile.ZIP64_LIMIT
+            ) as entry:
+                for chunk in iter(lambda: file.read(chunk_size), b""):
+                    entry.write(chunk)
+                    yield buffer.take()
+
+            yield buffer.take()
+
+    # The central directory is written, when the archive is closed.
+    yield buffer.take()
+
+
+def _list_files(root: Path) -> List[Path]:
+    """List the files of a folder and its `masks` and `measurements` sub folders.
+
+    :param root: Folder.
+    :return: List of file paths.
+    """
+    paths = []
+
+    for directory in (root, root / "masks", root / "measurements"):
+        if directory.is_dir():
+            paths += [Path(entry.path) for entry in os.scandir(str(directory)) if entry.is_file()]
+
+    return paths
@@ -0,0 +1,197 @@
+import bisect
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Collection, List, Optional, Set
+
+from .custom_types import AnyPath
+
+WATCHER = os.getenv("INPUT_WATCHER", "auto").lower()  # "auto", "inotify" or "polling"
+POLLING_INTERVAL = float(os.getenv("INPUT_POLLING_INTERVAL", 1.0))
+
+
+class ImageIndex:
+    """Incrementally maintained index of the images and `annotation_*.csv` files in a folder.
+
+    The index is kept up to date by a background thread, which either uses inotify (if the `inotify_simple` package
+    is available) or polls the modification time of the folder. Folders that are shared with the host system via
+    Docker Desktop do not propagate inotify events. In this case, set the environment variable `INPUT_WATCHER` to
+    `polling`.
+    """
+
+    def __init__(self, root: AnyPath, polling_interval: float = POLLING_INTERVAL):
+        """
+        :param root: Folder to be indexed.
+        :param polling_interval: Interval in seconds, in which the folder is checked for changes, if inotify is not
+            available.
+        """
+        self.root = Path(root)
+        self.polling_interval = polling_interval
+
+        self._lock = threading.Lock()
+        self._image_paths = []  # type: List[Path]
+        self._csv_names = set()  # type: Set[str]
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def start(self):
+        """Scan the folder and start watching it for changes."""
+        self.rescan()
+
+        self._thread = threading.Thread(target=self._watch, name="image-index", daemon=True)
+        self._thread.start()
+
+    def rescan(self):
+        """Rebuild the index from scratch."""
+        image_paths = []
+        csv_names = set()
+
+        if self.root.is_dir():
+            for entry in os.scandir(str(self.root)):
+                if not entry.is_file():
+                    continue
+                if _is_csv(entry.name):
+                    csv_names.add(entry.name)
+                elif _is_image(entry.name):
+                    image_paths.append(self.root / entry.name)
+
+        with self._lock:
+            self._image_paths = sorted(image_paths)
+            self._csv_names = csv_names
+
+    def add(self, path: AnyPath):
+        """Add a file to the index.
+
+        :param path: Path of the file.
+        """
+        path = Path(path)
+
+        with self._lock:
+            if _is_csv(path.name):
+                self._csv_names.add(path.name)
+            elif _is_image(path.name):
+                position = bisect.bisect_left(self._image_paths, path)
+                if position == len(self._image_paths) or self._image_paths[position] != path:
+                    self._image_paths.insert(position, path)
+
+    def discard(self, path: AnyPath):
+        """Remove a file from the index, if it is part of it.
+
+        :param path: Path of the file.
+        """
+        path = Path(path)
+
+        with self._lock:
+            if _is_csv(path.name):
+                self._csv_names.discard(path.name)
+            else:
+                position = bisect.bisect_left(self._image_paths, path)
+                if position < len(self._image_paths) and self._image_paths[position] == path:
+                    del self._image_paths[position]
+
+    def first(self, excluded: Collection[str] = ()) -> Optional[Path]:
+        """Get the first image of the folder.
+
+        :param excluded: Paths of images to be skipped.
+        :return: Path of the first image or None, if there are no images.
+        """
+        with self._lock:
+            for image_path in self._image_paths:
+                if str(image_path) not in excluded:
+                    return image_path
+
+    def get_image_paths(self) -> List[Path]:
+        """Get a sorted list of the paths of all images of the folder.
+
+        :return: List of image paths.
+        """
+        with self._lock:
+            return list(self._image_paths)
+
+    def get_csv_paths(self) -> List[Path]:
+        """Get a sorted list of the paths of all csv files of the folder.
+
+        :return: List of csv paths.
+        """
+        with self._lock:
+            return [self.root / csv_name for csv_name in sorted(self._csv_names)]
+
+    def has_csv(self, csv_path: AnyPath) -> bool:
+        """Check if a csv file is part of the folder.
+
+        :param csv_path: Path of the csv file.
+        :return: True, if the csv file exists, false, if not.
+        """
+        with self._lock:
+            return Path(csv_path).name in self._csv_names
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._image_paths)
+
+    def _watch(self):
+        """Keep the index up to date."""
+        if WATCHER in ("auto", "inotify"):
+            try:
+                self._watch_inotify()
+                return
+            except (ImportError, OSError) as error:
+                if WATCHER == "inotify":
+                    raise
+                print(f"⚠️ Falling back to polling {self.root} ({error}).", flush=True)
+
+        self._watch_polling()
+
+    def _watch_inotify(self):
+        """Keep the index up to date, based on inotify events."""
+        from inotify_simple import INotify, flags
+
+        inotify = INotify()
+        inotify.add_watch(
+            str(self.root),
+            flags.CLOSE_WRITE
+            | flags.MOVED_TO
+            | flags.MOVED_FROM
+            | flags.DELETE
+            | flags.DELETE_SELF
+            | flags.MOVE_SELF,
+        )
+
+        # Catch changes, which happened between the initial scan and the creation of the watch.
+        self.rescan()
+
+        while True:
+            for event in inotify.read():
+                if event.mask & flags.Q_OVERFLOW:
+                    self.rescan()
+                elif event.mask & (flags.DELETE_SELF | flags.MOVE_SELF | flags.IGNORED):
+                    raise OSError(f"{self.root} was removed or moved.")
+                elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                    self.add(self.root / event.name)
+                elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                    self.discard(self.root / event.name)
+
+    def _watch_polling(self):
+        """Keep the index up to date, by rescanning the folder, whenever its modification time changes."""
+        last_modification_time = None
+
+        while True:
+            try:
+                modification_time = os.stat(str(self.root)).st_mtime_ns
+            except FileNotFoundError:
+                modification_time = None
+
+            if modification_time != last_modification_time:
+                self.rescan()
+                last_modification_time = modification_time
+
+            time.sleep(self.polling_interval)
+
+
+def _is_csv(file_name: str) -> bool:
+    return file_name.lower().endswith(".csv")
+
+
+def _is_image(file_name: str) -> bool:
+    # Hidden files are skipped, since they are usually temporary files of other applications.
+    return not file_name.startswith(".") and "." in file_name
@@ -0,0 +1,63 @@
+"""Instance label images, which merge all masks of an image into a single image."""
+
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from .custom_types import AnyPath
+
+# Largest label, which can be stored in a 16-bit PNG. Label images with more instances are stored as 32-bit TIFF.
+MAX_LABEL_UINT16 = np.iinfo(np.uint16).max
+
+
+def get_label_image(masks: np.ndarray, threshold: float = 0.5, chunk_size: int = 64) -> np.ndarray:
+    """Merge instance masks into a single label image. Pixels, which belong to multiple instances, are assigned to
+    the instance with the highest mask probability.
+
+    The masks are processed in chunks, keeping a running maximum of the probabilities, so that no temporary array
+    of the size of all masks is needed.
+
+    :param masks: Mask probabilities [N, Y, X].
+    :param threshold: Threshold to binarize the masks.
+    :param chunk_size: Number of masks, which are processed at once.
+    :return: Label image [Y, X] (int32), where 0 is background and i + 1 is the label of the i-th instance.
+    """
+    num_instances, height, width = masks.shape
+
+    labels = np.zeros((height, width), dtype=np.int32)
+    # Pixels need a probability above the threshold, to be assigned to an instance at all.
+    maximum = np.full((height, width), threshold, dtype=np.float32)
+
+    for start in range(0, num_instances, chunk_size):
+        chunk = masks[start : start + chunk_size]
+        chunk_labels = np.argmax(chunk, axis=0)
+        chunk_maximum = np.take_along_axis(chunk, chunk_labels[np.newaxis], axis=0)[0]
+
+        # Ties are resolved in favour of the instance with the lower index, like `np.argmax`.
+        is_greater = chunk_maximum > maximum
+        labels[is_greater] = chunk_labels[is_greater] + start + 1
+        maximum[is_greater] = chunk_maximum[is_greater]
+
+    return labels
+
+
+def write_label_image(label_root: AnyPath, image_identifier: str, labels: np.ndarray) -> Path:
+    """Store a label image as 16-bit PNG (`labels_<id>.png`) or, if it has too many instances, as 32-bit TIFF
+    (`labels_<id>.tif`).
+
+    :param label_root: Output folder.
+    :param image_identifier: Image id.
+    :param labels: Label image [Y, X].
+    :return: Path of the label image.
+    """
+    label_root = Path(label_root)
+
+    if labels.max(initial=0) <= MAX_LABEL_UINT16:
+        label_path = label_root / f"labels_{image_identifier}.png"
+        Image.fromarray(labels.astype(np.uint16)).save(label_path)
+    else:
+        label_path = label_root / f"labels_{image_identifier}.tif"
+        Image.fromarray(labels.astype(np.int32)).save(label_path, compression="tiff_deflate")
+
+    return label_path
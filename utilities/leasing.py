@@ -0,0 +1,97 @@
+import os
+import time
+from typing import Callable, Optional, Set
+
+from .shared_state import SharedState, get_shared_state
+
+LEASE_DURATION = float(os.getenv("LEASE_DURATION", 300))
+
+# Function that returns the first work item, which is not part of the given set of excluded work items.
+CandidateSelector = Callable[[Set[str]], Optional[str]]
+
+
+class LeaseManager:
+    """Hand out work items (e.g. images) to concurrent users, so that no two users work on the same item.
+
+    Every user is identified by a token. A lease expires, if it is not renewed within `lease_duration` seconds, e.g.
+    because the user closed the browser. The leases are stored in the shared state, so that they are respected by all
+    worker processes of the server.
+    """
+
+    def __init__(self, lease_duration: float = LEASE_DURATION, state: Optional[SharedState] = None):
+        """
+        :param lease_duration: Time in seconds, after which a lease expires, if it is not renewed.
+        :param state: Shared state to store the leases in. Defaults to the shared state of the application.
+        """
+        self.lease_duration = lease_duration
+        self._state = state
+
+    @property
+    def state(self) -> SharedState:
+        return self._state or get_shared_state()
+
+    def acquire(self, token: str, select_candidate: CandidateSelector) -> Optional[str]:
+        """Lease the first work item, which is not leased by another user. A user holds at most one lease at a time.
+
+        :param token: Token of the user.
+        :param select_candidate: Function that returns the first work item, which is not part of a set of excluded
+            work items.
+        :return: Leased work item or None, if there are no free work items.
+        """
+        with self.state.transaction() as connection:
+            now = time.time()
+            connection.execute("DELETE FROM leases WHERE expiry < ?", (now,))
+
+            excluded = {
+                row[0]
+                for row in connection.execute("SELECT item FROM leases WHERE token != ?", (token,))
+            }
+            item = select_candidate(excluded)
+
+            connection.execute("DELETE FROM leases WHERE token = ?", (token,))
+
+            if item is not None:
+                connection.execute(
+                    "INSERT INTO leases (item, token, expiry) VALUES (?, ?, ?)",
+                    (item, token, now + self.lease_duration),
+                )
+
+            return item
+
+    def renew(self, token: str, item: Optional[str] = None) -> bool:
+        """Renew the lease of a user.
+
+        :param token: Token of the user.
+        :param item: Work item, which the user needs to hold. If the lease of the user has expired, but the item has
+            not been leased by another user in the meantime, then the item is leased to the user again.
+        :return: True, if the user holds a lease (on the item, if specified), false, if not.
+        """
+        with self.state.transaction() as connection:
+            now = time.time()
+            connection.execute("DELETE FROM leases WHERE expiry < ?", (now,))
+
+            if item is None:
+                cursor = connection.execute(
+                    "UPDATE leases SET expiry = ? WHERE token = ?",
+                    (now + self.lease_duration, token),
+                )
+                return cursor.rowcount > 0
+
+            row = connection.execute("SELECT token FROM leases WHERE item = ?", (item,)).fetchone()
+            if row is not None and row[0] != token:
+                return False
+
+            connection.execute("DELETE FROM leases WHERE token = ?", (token,))
+            connection.execute(
+                "INSERT INTO leases (item, token, expiry) VALUES (?, ?, ?)",
+                (item, token, now + self.lease_duration),
+            )
+            return True
+
+    def release(self, token: str):
+        """Release the lease of a user.
+
+        :param token: Token of the user.
+        """
+        with self.state.transaction() as connection:
+            connection.execute("DELETE FROM leases WHERE token = ?", (token,))
@@ -0,0 +1,189 @@
+"""Compressed storage of the instance masks of an image in a single `.npz`-file.
+
+Every mask is cropped to its box and stored as a separate, individually compressed member of the archive, so that
+single instances (or all instances within a region of the image) can be loaded, without decompressing the whole
+stack of masks.
+"""
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .custom_types import AnyPath
+from .data import get_pixel_bounds
+
+
+def write_mask_archive(
+    path: AnyPath, masks: np.ndarray, boxes: pd.DataFrame, threshold: float = 0.5
+):
+    """Write the masks of an image into a compressed archive.
+
+    :param path: Output path (`*.npz`).
+    :param masks: Mask probabilities [N, Y, X].
+    :param boxes: pandas dataframe with columns ["x0", "y0", "x1", "y1"].
+    :param threshold: Threshold to binarize the masks.
+    """
+    num_instances, height, width = masks.shape
+
+    crops, bounds = crop_masks(masks, boxes)
+    scores = np.zeros(num_instances, dtype=np.float32)
+    members = {}
+
+    for index, crop in enumerate(crops):
+        binary_crop = crop > threshold
+
+        # Mean probability of the pixels of the mask, as a measure of the confidence of the model.
+        scores[index] = crop[binary_crop].mean() if binary_crop.any() else 0
+        members[_get_member_name(index)] = binary_crop
+
+    np.savez_compressed(
+        path,
+        image_shape=np.array([height, width], dtype=np.int32),
+        boxes=boxes[["x0", "y0", "x1", "y1"]].to_numpy(dtype=np.float32),
+        bounds=bounds,
+        scores=scores,
+        **members,
+    )
+
+
+def crop_masks(masks: np.ndarray, boxes: pd.DataFrame) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Crop masks to their boxes. The predicted masks are zero outside of their boxes, so no information is lost.
+
+    :param masks: Masks [N, Y, X].
+    :param boxes: pandas dataframe with columns ["x0", "y0", "x1", "y1"].
+    :return: Cropped masks and their bounds [N, 4] (y0, x0, y1, x1).
+    """
+    num_instances, height, width = masks.shape
+
+    bounds = np.zeros((num_instances, 4), dtype=np.int32)
+    crops = []
+
+    for index, (mask, box) in enumerate(zip(masks, boxes.itertuples(index=False))):
+        y0, x0, y1, x1 = get_pixel_bounds(box.x0, box.y0, box.x1, box.y1, height, width)
+        bounds[index] = y0, x0, y1, x1
+        crops.append(mask[y0:y1, x0:x1])
+
+    return crops, bounds
+
+
+def paste_masks(
+    crops: Sequence[np.ndarray], bounds: np.ndarray, image_shape: Tuple[int, int]
+) -> np.ndarray:
+    """Paste cropped masks into full image masks (inverse of `crop_masks`).
+
+    :param crops: Cropped masks.
+    :param bounds: Bounds [N, 4] (y0, x0, y1, x1) of the cropped masks.
+    :param image_shape: Height and width of the image.
+    :return: Masks [N, Y, X], with the data type of the cropped masks.
+    """
+    dtype = crops[0].dtype if len(crops) else bool
+    masks = np.zeros((len(crops),) + tuple(image_shape), dtype=dtype)
+
+    for mask, crop, (y0, x0, y1, x1) in zip(masks, crops, bounds):
+        mask[y0:y1, x0:x1] = crop
+
+    return masks
+
+
+class MaskArchive:
+    """Read access to a mask archive, which only decompresses the requested masks."""
+
+    def __init__(self, path: AnyPath):
+        """
+        :param path: Path of the archive (`*.npz`).
+        """
+        self._archive = np.load(str(path))
+        self.image_shape = tuple(self._archive["image_shape"])  # type: Tuple[int, int]
+        self.boxes = self._archive["boxes"]  # type: np.ndarray
+        self.bounds = self._archive["bounds"]  # type: np.ndarray
+        self.scores = self._archive["scores"]  # type: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.bounds)
+
+    def __enter__(self) -> "MaskArchive":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """Close the underlying file."""
+        self._archive.close()
+
+    def get_crop(self, index: int) -> np.ndarray:
+        """Get a mask, cropped to its box.
+
+        :param index: Index of the instance.
+        :return: Mask [H, W], where H and W are the height and width of `bounds[index]`.
+        """
+        return self._archive[_get_member_name(index)]
+
+    def get_mask(self, index: int) -> np.ndarray:
+        """Get a full image mask.
+
+        :param index: Index of the instance.
+        :return: Mask [Y, X].
+        """
+        mask = np.zeros(self.image_shape, dtype=bool)
+        y0, x0, y1, x1 = self.bounds[index]
+        mask[y0:y1, x0:x1] = self.get_crop(index)
+        return mask
+
+    def get_masks(self) -> np.ndarray:
+        """Get all full image masks.
+
+        :return: Masks [N, Y, X].
+        """
+        return paste_masks(
+            [self.get_crop(index) for index in range(len(self))], self.bounds, self.image_shape
+        )
+
+    def get_indices_in_region(self, y0: int, x0: int, y1: int, x1: int) -> List[int]:
+        """Get the indices of all instances, whose box intersects a region (e.g. a tile) of the image.
+
+        :param y0: First row of the region.
+        :param x0: First column of the region.
+        :param y1: Row after the last row of the region.
+        :param x1: Column after the last column of the region.
+        :return: Indices of the instances.
+        """
+        intersects = (
+            (self.bounds[:, 0] < y1)
+            & (self.bounds[:, 2] > y0)
+            & (self.bounds[:, 1] < x1)
+            & (self.bounds[:, 3] > x0)
+        )
+        return np.flatnonzero(intersects).tolist()
+
+    def get_region(self, y0: int, x0: int, y1: int, x1: int) -> Tuple[List[int], np.ndarray]:
+        """Get the masks of all instances within a region (e.g. a tile) of the image. Only the masks of instances,
+        whose box intersects the region, are decompressed.
+
+        :param y0: First row of the region.
+        :param x0: First column of the region.
+        :param y1: Row after the last row of the region.
+        :param x1: Column after the last column of the region.
+        :return: Indices of the instances and their masks [n, y1 - y0, x1 - x0], cropped to the region.
+        """
+        indices = self.get_indices_in_region(y0, x0, y1, x1)
+        masks = np.zeros((len(indices), y1 - y0, x1 - x0), dtype=bool)
+
+        for mask, index in zip(masks, indices):
+            box_y0, box_x0, box_y1, box_x1 = self.bounds[index]
+            crop = self.get_crop(index)
+
+            # Intersection of box and region, in image coordinates.
+            top, left = max(box_y0, y0), max(box_x0, x0)
+            bottom, right = min(box_y1, y1), min(box_x1, x1)
+
+            mask[top - y0 : bottom - y0, left - x0 : right - x0] = crop[
+                top - box_y0 : bottom - box_y0, left - box_x0 : right - box_x0
+            ]
+
+        return indices, masks
+
+
+def _get_member_name(index: int) -> str:
+    return f"mask_{index:05d}"
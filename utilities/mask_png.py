@@ -0,0 +1,162 @@
+"""Parallel encoding of instance masks as 1-bit png-files (`masks/mask_<id>_<index>.png`).
+
+The masks are packed into 1 bit per pixel with numpy and encoded in a thread pool (Pillow releases the GIL while
+compressing). Optionally, every mask is cropped to its box; the position of the crop and the size of the image are
+then stored as text chunks of the png-file (see `read_mask_png`).
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from PIL import Image, PngImagePlugin
+
+from .custom_types import AnyPath
+from .data import get_pixel_bounds
+
+# zlib compression level of the png-files (0: no compression, 9: best compression). Masks compress well even with
+# low levels, which are much faster than the default level of Pillow (6).
+MASK_PNG_COMPRESSION = int(os.getenv("MASK_PNG_COMPRESSION", 1))
+# If true, then every mask is cropped to its box, instead of being stored with the size of the image.
+MASK_PNG_CROP = os.getenv("MASK_PNG_CROP", "False").lower() in ("true", "1", "t")
+# Number of threads, which encode masks (0: one per CPU, at most 8).
+MASK_PNG_THREADS = int(os.getenv("MASK_PNG_THREADS", 0)) or min(8, os.cpu_count() or 1)
+
+_pool = None  # type: Optional[ThreadPoolExecutor]
+_pool_pid = None  # type: Optional[int]
+_pool_lock = threading.Lock()
+
+
+class MaskEncodingStats(NamedTuple):
+    num_masks: int
+    num_bytes: int  # size of the written files
+    duration: float  # wall time in seconds
+
+
+def write_mask_pngs(
+    mask_root: AnyPath,
+    image_identifier: str,
+    masks: np.ndarray,
+    boxes: pd.DataFrame,
+    threshold: float = 0.5,
+    compress_level: int = MASK_PNG_COMPRESSION,
+    crop: bool = MASK_PNG_CROP,
+) -> MaskEncodingStats:
+    """Write every mask of an image as 1-bit png-file `mask_<id>_<index>.png`.
+
+    :param mask_root: Output folder of the masks.
+    :param image_identifier: Image id.
+    :param masks: Mask probabilities [N, Y, X].
+    :param boxes: pandas dataframe with columns ["x0", "y0", "x1", "y1"].
+    :param threshold: Threshold to binarize the masks.
+    :param compress_level: zlib compression level (0-9).
+    :param crop: If true, then the masks are cropped to their boxes.
+    :return: Number of masks, number of written bytes and duration.
+    """
+    mask_root = Path(mask_root)
+    num_instances, height, width = masks.shape
+    start = time.perf_counter()
+
+    futures = []
+    for index, (mask, box) in enumerate(zip(masks, boxes.itertuples(index=False))):
+        bounds = (
+            get_pixel_bounds(box.x0, box.y0, box.x1, box.y1, height, width)
+            if crop
+            else (0, 0, height, width)
+        )
+        futures.append(
+            _get_pool().submit(
+                _write_mask_png,
+                mask_root / f"mask_{image_identifier}_{index}.png",
+                mask,
+                bounds,
+                threshold,
+                compress_level,
+            )
+        )
+
+    num_bytes = sum(future.result() for future in futures)
+    return MaskEncodingStats(num_instances, num_bytes, time.perf_counter() - start)
+
+
+def read_mask_png(path: AnyPath) -> np.ndarray:
+    """Read a mask, which has been written by `write_mask_pngs`. Cropped masks are restored to the size of the image.
+
+    :param path: Path of the png-file.
+    :return: Mask [Y, X].
+    """
+    with Image.open(str(path)) as image:
+        mask = np.array(image, dtype=bool)
+        text = getattr(image, "text", {})
+
+    if "image_height" not in text:
+        return mask
+
+    full_mask = np.zeros((int(text["image_height"]), int(text["image_width"])), dtype=bool)
+    y0, x0 = int(text["y0"]), int(text["x0"])
+    full_mask[y0 : y0 + mask.shape[0], x0 : x0 + mask.shape[1]] = mask
+    return full_mask
+
+
+def _write_mask_png(
+    path: Path,
+    mask: np.ndarray,
+    bounds: Tuple[int, int, int, int],
+    threshold: float,
+    compress_level: int,
+) -> int:
+    """Binarize, crop and encode a single mask.
+
+    :param path: Output path.
+    :param mask: Mask probabilities [Y, X].
+    :param bounds: Bounds (y0, x0, y1, x1) of the crop.
+    :param threshold: Threshold to binarize the mask.
+    :param compress_level: zlib compression level (0-9).
+    :return: Size of the written file in bytes.
+    """
+    height, width = mask.shape
+    y0, x0, y1, x1 = bounds
+    # png-files cannot be empty, so degenerate boxes are stored as a single pixel.
+    y0, x0 = min(y0, height - 1), min(x0, width - 1)
+    y1, x1 = max(y1, y0 + 1), max(x1, x0 + 1)
+    crop = mask[y0:y1, x0:x1] > threshold
+
+    # Pack 8 pixels per byte, which is the raw format of 1-bit images in Pillow.
+    image = Image.frombytes(
+        "1", (crop.shape[1], crop.shape[0]), np.packbits(crop, axis=1).tobytes()
+    )
+
+    png_info = None
+    if crop.shape != (height, width):
+        png_info = PngImagePlugin.PngInfo()
+        for key, value in (
+            ("x0", x0),
+            ("y0", y0),
+            ("image_width", width),
+            ("image_height", height),
+        ):
+            png_info.add_text(key, str(value))
+
+    image.save(path, format="PNG", compress_level=compress_level, pnginfo=png_info)
+    return path.stat().st_size
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """Get the thread pool of the current process. It is created on first use.
+
+    :return: Thread pool.
+    """
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        # Threads do not survive a fork, so worker processes need their own pool.
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max(1, MASK_PNG_THREADS))
+            _pool_pid = os.getpid()
+
+    return _pool
@@ -0,0 +1,162 @@
+"""Vectorized morphology measurements of particles, based on a label image of the predicted masks."""
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from .custom_types import AnyPath
+from .labels import get_label_image
+
+MEASUREMENT_FOLDER_NAME = "measurements"
+
+
+def measure_instances(labels: np.ndarray, num_instances: int) -> pd.DataFrame:
+    """Measure the morphology of all instances of a label image at once, without a loop over the instances.
+
+    :param labels: Label image [Y, X], where 0 is background and i + 1 is the label of the i-th instance.
+    :param num_instances: Number of instances.
+    :return: Dataframe with one row per instance and the columns ["area", "perimeter", "equivalent_diameter",
+        "centroid_x", "centroid_y", "x0", "y0", "x1", "y1", "major_axis_length", "minor_axis_length",
+        "aspect_ratio"]. Coordinates are in pixels; (x1, y1) is exclusive. Instances, which are completely hidden by
+        other instances, have an area of 0 and NaN values.
+    """
+    height, width = labels.shape
+    num_bins = num_instances + 1
+
+    foreground_indices = np.flatnonzero(labels)
+    foreground_labels = labels.ravel()[foreground_indices]
+    rows = (foreground_indices // width).astype(np.float64)
+    columns = (foreground_indices % width).astype(np.float64)
+
+    def sum_per_instance(weights=None) -> np.ndarray:
+        return np.bincount(foreground_labels, weights=weights, minlength=num_bins)[1:num_bins]
+
+    areas = sum_per_instance()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        centroids_y = sum_per_instance(rows) / areas
+        centroids_x = sum_per_instance(columns) / areas
+
+        # Central second moments.
+        moments_yy = sum_per_instance(rows**2) / areas - centroids_y**2
+        moments_xx = sum_per_instance(columns**2) / areas - centroids_x**2
+        moments_xy = sum_per_instance(rows * columns) / areas - centroids_x * centroids_y
+
+    # Eigenvalues of the covariance matrix, which correspond to the axes of an ellipse with the same moments.
+    mean_moment = (moments_xx + moments_yy) / 2
+    deviation = np.sqrt(((moments_xx - moments_yy) / 2) ** 2 + moments_xy**2)
+    major_axis_lengths = 4 * np.sqrt(np.maximum(mean_moment + deviation, 0))
+    minor_axis_lengths = 4 * np.sqrt(np.maximum(mean_moment - deviation, 0))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        aspect_ratios = np.where(
+            minor_axis_lengths > 0, major_axis_lengths / minor_axis_lengths, np.nan
+        )
+
+    x0, y0, x1, y1 = _get_bounding_boxes(foreground_labels, rows, columns, num_instances)
+
+    return pd.DataFrame(
+        {
+            "area": areas.astype(np.int64),
+            "perimeter": _get_perimeters(labels, num_instances),
+            "equivalent_diameter": np.sqrt(4 * areas / np.pi),
+            "centroid_x": centroids_x,
+            "centroid_y": centroids_y,
+            "x0": x0,
+            "y0": y0,
+            "x1": x1,
+            "y1": y1,
+            "major_axis_length": major_axis_lengths,
+            "minor_axis_length": minor_axis_lengths,
+            "aspect_ratio": aspect_ratios,
+        }
+    )
+
+
+def write_measurements(
+    measurement_root: AnyPath,
+    image_identifier: str,
+    masks: np.ndarray,
+    labels: Optional[np.ndarray] = None,
+):
+    """Measure the instances of an image and store the measurements as `measurements_<id>.csv`.
+
+    :param measurement_root: Output folder of the measurements.
+    :param image_identifier: Image id.
+    :param masks: Mask probabilities [N, Y, X].
+    :param labels: Label image of the masks. Computed from the masks, if not specified.
+    """
+    measurement_root = Path(measurement_root)
+    measurement_root.mkdir(exist_ok=True, parents=True)
+
+    if labels is None:
+        labels = get_label_image(masks)
+
+    measurements = measure_instances(labels, len(masks))
+    measurements.insert(0, "image_id", image_identifier)
+    measurements.to_csv(
+        measurement_root / f"measurements_{image_identifier}.csv", index=True, index_label="index"
+    )
+
+
+def consolidate_measurements(model_results_root: AnyPath):
+    """Combine the measurements of all images of a model into a single file (`measurements.csv`).
+
+    :param model_results_root: Output folder of the model.
+    """
+    model_results_root = Path(model_results_root)
+    csv_paths = sorted((model_results_root / MEASUREMENT_FOLDER_NAME).glob("measurements_*.csv"))
+
+    if not csv_paths:
+        return
+
+    measurements = pd.concat([pd.read_csv(csv_path) for csv_path in csv_paths], ignore_index=True)
+    measurements.to_csv(model_results_root / "measurements.csv", index=False)
+
+
+def _get_perimeters(labels: np.ndarray, num_instances: int) -> np.ndarray:
+    """Get the perimeters of all instances of a label image, as the number of pixels of an instance, which have a
+    4-neighbor with a different label (or lie at the border of the image).
+
+    :param labels: Label image [Y, X].
+    :param num_instances: Number of instances.
+    :return: Perimeters [N].
+    """
+    padded = np.pad(labels, 1, mode="constant", constant_values=0)
+    center = padded[1:-1, 1:-1]
+    is_boundary = (
+        (center != padded[:-2, 1:-1])
+        | (center != padded[2:, 1:-1])
+        | (center != padded[1:-1, :-2])
+        | (center != padded[1:-1, 2:])
+    ) & (center > 0)
+
+    return np.bincount(center[is_boundary], minlength=num_instances + 1)[1 : num_instances + 1]
+
+
+def _get_bounding_boxes(foreground_labels, rows, columns, num_instances):
+    """Get the bounding boxes of all instances, by sorting the foreground pixels by label and reducing each group.
+
+    :param foreground_labels: Labels of the foreground pixels.
+    :param rows: Rows of the foreground pixels.
+    :param columns: Columns of the foreground pixels.
+    :param num_instances: Number of instances.
+    :return: Arrays x0, y0, x1, y1 [N], which are NaN for instances without pixels.
+    """
+    x0, y0, x1, y1 = (np.full(num_instances, np.nan) for _ in range(4))
+
+    if not len(foreground_labels):
+        return x0, y0, x1, y1
+
+    order = np.argsort(foreground_labels, kind="stable")
+    sorted_labels = foreground_labels[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    present = sorted_labels[group_starts] - 1
+
+    x0[present] = np.minimum.reduceat(columns[order], group_starts)
+    y0[present] = np.minimum.reduceat(rows[order], group_starts)
+    x1[present] = np.maximum.reduceat(columns[order], group_starts) + 1
+    y1[present] = np.maximum.reduceat(rows[order], group_starts) + 1
+
+    return x0, y0, x1, y1
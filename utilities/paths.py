@@ -4,3 +4,4 @@ ROOT = Path("/home/tensorflow/app/data")
 INPUT_ROOT = ROOT / "input"
 ANNOTATED_ROOT = ROOT / "annotated"
 RESULTS_ROOT = ROOT / "results"
+PROFILES_ROOT = ROOT / "profiles"
@@ -1,25 +1,143 @@
 import json
 import os
+import threading
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 import requests
 import tensorflow as tf
 
+from . import embedded_inference
 from .data import sort_box_coordinates
 from .ops import reframe_box_masks_to_image_masks
 
-MODEL_HOST = os.environ["MODEL_HOST"]
-PORT_BACKEND = os.environ["PORT_BACKEND"]
+MODEL_HOST = os.getenv("MODEL_HOST", "localhost")
+PORT_BACKEND = os.getenv("PORT_BACKEND", "8501")
 
+# Backend for the inference:
+#   rest: requests to the REST API of the model server (`MODEL_HOST`, `PORT_BACKEND`)
+#   embedded: the models are loaded into the current process, see `utilities.embedded_inference`
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "rest").lower()
 
-def predict_masks(image: np.ndarray, boxes: pd.DataFrame, model_name: str) -> np.ndarray:
+if INFERENCE_BACKEND == "embedded":
+    # The number of threads can only be set, before TensorFlow executes its first operation.
+    embedded_inference.configure_threads()
+
+MODEL_NAMES = {"Deep-MARC": "deepmarc", "Deep-MAC": "deepmac"}
+
+# Concurrent interactive requests (e.g. mask previews of several users) for the same image and model, which arrive
+# within this number of milliseconds, are merged into a single request to the model (0: disabled).
+PREDICTION_BATCH_WINDOW = float(os.getenv("PREDICTION_BATCH_WINDOW_MS", 20)) / 1000
+
+# Maximum number of boxes of a merged request.
+PREDICTION_MAX_BATCH = int(os.getenv("PREDICTION_MAX_BATCH", 256))
+
+
+class _Batch:
+    """Boxes of concurrent requests for the same image and model, which are sent to the model at once."""
+
+    def __init__(self, image: np.ndarray):
+        self.image = image
+        self.boxes = []  # type: List[np.ndarray]
+        self.num_boxes = 0
+        self.is_full = threading.Event()
+        self.is_done = threading.Event()
+        self.masks = None  # type: Optional[np.ndarray]
+        self.error = None  # type: Optional[BaseException]
+
+
+class PredictionBatcher:
+    """Merge concurrent prediction requests for the same image and model.
+
+    The first request of a batch waits for the batch window (or until the batch is full), sends all boxes, which have
+    been collected in the meantime, to the model and hands the masks back to the other requests of the batch.
+    """
+
+    def __init__(
+        self,
+        predict_function: Callable[[np.ndarray, np.ndarray, str], np.ndarray],
+        window: float = PREDICTION_BATCH_WINDOW,
+        max_batch_size: int = PREDICTION_MAX_BATCH,
+    ):
+        """
+        :param predict_function: Function, which predicts box masks [N, H, W] for an image, normalized boxes [N, 4]
+            and a model name.
+        :param window: Time in seconds, for which requests are collected.
+        :param max_batch_size: Maximum number of boxes per batch.
+        """
+        self.predict_function = predict_function
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._open_batches = {}  # type: Dict[Tuple[Hashable, str], _Batch]
+        self._lock = threading.Lock()
+
+    def predict(
+        self, image_key: Hashable, image: np.ndarray, boxes: np.ndarray, model_name: str
+    ) -> np.ndarray:
+        """Predict box masks, possibly together with concurrent requests for the same image and model.
+
+        :param image_key: Key, which identifies the image (e.g. its path).
+        :param image: Image [Y, X, 3].
+        :param boxes: Normalized boxes [N, 4].
+        :param model_name: Name of the model.
+        :return: Box masks [N, H, W].
+        """
+        batch_key = (image_key, model_name)
+
+        with self._lock:
+            batch = self._open_batches.get(batch_key)
+            is_leader = batch is None or batch.num_boxes + len(boxes) > self.max_batch_size
+
+            if is_leader:
+                if batch is not None:  # Send the full batch right away.
+                    batch.is_full.set()
+                batch = _Batch(image)
+                self._open_batches[batch_key] = batch
+
+            offset = batch.num_boxes
+            batch.boxes.append(boxes)
+            batch.num_boxes += len(boxes)
+
+            if batch.num_boxes >= self.max_batch_size:
+                batch.is_full.set()
+
+        if is_leader:
+            batch.is_full.wait(self.window)
+
+            with self._lock:
+                if self._open_batches.get(batch_key) is batch:
+                    del self._open_batches[batch_key]
+
+            try:
+                batch.masks = np.asarray(
+                    self.predict_function(batch.image, np.concatenate(batch.boxes), model_name)
+                )
+            except BaseException as error:
+                batch.error = error
+                raise
+            finally:
+                batch.is_done.set()
+        else:
+            batch.is_done.wait()
+
+            if batch.error is not None:
+                raise batch.error
+
+        return batch.masks[offset : offset + len(boxes)]
+
+
+def predict_masks(
+    image: np.ndarray, boxes: pd.DataFrame, model_name: str, image_key: Optional[Hashable] = None
+) -> np.ndarray:
     """Predict instance masks for an image and a given set of boxes.
 
     :param image: input image [Y,X,3]
     :param boxes: pandas dataframe with columns ["y0", "x0", "y1", "x1"]
     :param model_name: name of the model to use for the evaluation.
         Either "deepmarc" or "deepmac".
+    :param image_key: Key, which identifies the image (e.g. its path). If specified, then the request may be merged
+        with concurrent requests for the same image and model (see `PredictionBatcher`).
     :return: instance masks [N, Y, X]
     """
 
@@ -46,13 +164,14 @@ def predict_masks(image: np.ndarray, boxes: pd.DataFrame, model_name: str) -> np
 
     boxes_numpy = boxes.to_numpy().astype(np.float32)
 
-    if model_name == "deepmarc":
-        masks = get_deepmarc_response(image, boxes_numpy)
-    elif model_name == "deepmac":
-        masks = get_deepmac_response(image, boxes_numpy)
-    else:
+    if model_name not in MODEL_NAMES.values():
         raise ValueError(f"Unknown model name: {model_name}")
 
+    if image_key is not None and _batcher.window > 0:
+        masks = _batcher.predict(image_key, image, boxes_numpy, model_name)
+    else:
+        masks = get_response(image, boxes_numpy, model_name)
+
     masks = reframe_box_masks_to_image_masks(
         tf.convert_to_tensor(masks),
         tf.convert_to_tensor(boxes_numpy),
@@ -62,6 +181,23 @@ def predict_masks(image: np.ndarray, boxes: pd.DataFrame, model_name: str) -> np
     return masks.numpy()
 
 
+def get_response(image: np.ndarray, boxes: np.ndarray, model_name: str) -> np.ndarray:
+    """Use a model to predict instance masks for an image and a given set of boxes.
+
+    :param image: input image [Y,X,3]
+    :param boxes: boxes [N, 4]
+    :param model_name: Either "deepmarc" or "deepmac".
+    :return: instance masks [N, Y, X]
+    """
+    if model_name == "deepmarc":
+        return get_deepmarc_response(image, boxes)
+
+    return get_deepmac_response(image, boxes)
+
+
+_batcher = PredictionBatcher(get_response)
+
+
 def get_deepmarc_response(image: np.ndarray, boxes: np.ndarray) -> np.ndarray:
     """Use Deep-MARC to predict instance masks for an image and a given set of boxes.
 
@@ -70,6 +206,14 @@ def get_deepmarc_response(image: np.ndarray, boxes: np.ndarray) -> np.ndarray:
     :return: instance masks [N, Y, X]
     """
 
+    if INFERENCE_BACKEND == "embedded":
+        outputs = embedded_inference.get_runner().predict(
+            "deepmarc", {"images": image[np.newaxis], "boxes": boxes[np.newaxis]}
+        )
+        # The signature has a single output, like the "outputs" of the REST API.
+        (masks,) = outputs.values()
+        return masks[0]
+
     inference_url = f"http://{MODEL_HOST}:{PORT_BACKEND}/v1/models/deepmarc:predict"
 
     boxes_numpy = np.expand_dims(boxes, axis=0)
@@ -99,6 +243,12 @@ def get_deepmac_response(image: np.ndarray, boxes: np.ndarray) -> np.ndarray:
     :return: instance masks [N, Y, X]
     """
 
+    if INFERENCE_BACKEND == "embedded":
+        outputs = embedded_inference.get_runner().predict(
+            "deepmac", {"input_tensor": image[np.newaxis], "boxes": boxes[np.newaxis]}
+        )
+        return outputs["detection_masks"][0]
+
     inference_url = f"http://{MODEL_HOST}:{PORT_BACKEND}/v1/models/deepmac:predict"
 
     data = json.dumps(
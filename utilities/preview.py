@@ -0,0 +1,141 @@
+import base64
+import io
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from .custom_types import AnyPath, ColorInt
+from .data import get_pixel_bounds, read_image
+from .prediction import predict_masks
+
+PREVIEW_COLOR = (0, 255, 255)  # type: ColorInt
+PREVIEW_ALPHA = 0.4
+
+CacheKey = Tuple[str, str, float, float, float, float]
+CropMask = Tuple[int, int, np.ndarray]  # (y0, x0, mask)
+
+
+class MaskPreviewCache:
+    """LRU cache of the predicted masks of individual boxes. The masks are stored cropped to their boxes, to keep the
+    memory footprint low."""
+
+    def __init__(self, max_size: int = 10000):
+        """
+        :param max_size: Maximum number of cached masks.
+        """
+        self.max_size = max_size
+        self._masks = OrderedDict()  # type: OrderedDict[CacheKey, CropMask]
+        self._lock = threading.Lock()
+
+    def get(self, key: CacheKey) -> Optional[CropMask]:
+        """Get a cached mask.
+
+        :param key: Cache key of the box.
+        :return: Mask, cropped to its box, or None, if the box has not been predicted yet.
+        """
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+            return mask
+
+    def put(self, key: CacheKey, mask: CropMask):
+        """Add a mask to the cache and evict the least recently used masks, if necessary.
+
+        :param key: Cache key of the box.
+        :param mask: Mask, cropped to its box.
+        """
+        with self._lock:
+            self._masks[key] = mask
+            self._masks.move_to_end(key)
+            while len(self._masks) > self.max_size:
+                self._masks.popitem(last=False)
+
+
+_cache = MaskPreviewCache()
+
+
+def get_cache_key(image_path: AnyPath, model_name: str, box: Dict) -> CacheKey:
+    """Get the cache key of a box.
+
+    :param image_path: Path of the image.
+    :param model_name: Name of the model.
+    :param box: Dictionary with keys ["x0", "y0", "x1", "y1"].
+    :return: Cache key.
+    """
+    return (
+        str(image_path),
+        model_name,
+        round(box["x0"], 1),
+        round(box["y0"], 1),
+        round(box["x1"], 1),
+        round(box["y1"], 1),
+    )
+
+
+def get_preview_masks(image_path: AnyPath, boxes: List[Dict], model_name: str) -> List[CropMask]:
+    """Get the masks of a list of boxes. Only boxes, which have not been predicted before, are sent to the model.
+
+    :param image_path: Path of the image.
+    :param boxes: List of dictionaries with keys ["x0", "y0", "x1", "y1"].
+    :param model_name: Name of the model to use for the prediction. Either "deepmarc" or "deepmac".
+    :return: List of masks, cropped to their boxes.
+    """
+    keys = [get_cache_key(image_path, model_name, box) for box in boxes]
+    masks = [_cache.get(key) for key in keys]
+
+    missing_indices = [index for index, mask in enumerate(masks) if mask is None]
+
+    if missing_indices:
+        image = read_image(image_path)
+        missing_boxes = pd.DataFrame([boxes[index] for index in missing_indices])[
+            ["x0", "y0", "x1", "y1"]
+        ]
+        missing_masks = predict_masks(image, missing_boxes, model_name, image_key=str(image_path))
+
+        for index, box, mask in zip(
+            missing_indices, missing_boxes.itertuples(index=False), missing_masks
+        ):
+            crop_mask = _crop_mask(mask > 0.5, box)
+            _cache.put(keys[index], crop_mask)
+            masks[index] = crop_mask
+
+    return masks
+
+
+def render_overlay(image_shape: Tuple[int, int], masks: List[CropMask]) -> str:
+    """Render masks into a transparent image, which can be overlaid on a figure.
+
+    :param image_shape: Height and width of the image.
+    :param masks: List of masks, cropped to their boxes.
+    :return: Overlay, encoded as base64 png.
+    """
+    height, width = image_shape
+    alpha = np.zeros((height, width), dtype=np.uint8)
+
+    for y0, x0, mask in masks:
+        crop = alpha[y0 : y0 + mask.shape[0], x0 : x0 + mask.shape[1]]
+        crop[mask] = int(PREVIEW_ALPHA * 255)
+
+    overlay = np.empty((height, width, 4), dtype=np.uint8)
+    overlay[..., :3] = PREVIEW_COLOR
+    overlay[..., 3] = alpha
+
+    buffer = io.BytesIO()
+    Image.fromarray(overlay, mode="RGBA").save(buffer, format="png")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def _crop_mask(mask: np.ndarray, box) -> CropMask:
+    """Crop a full image mask to its box.
+
+    :param mask: Mask [Y, X].
+    :param box: Named tuple with the fields x0, y0, x1, y1.
+    :return: Mask, cropped to the box.
+    """
+    y0, x0, y1, x1 = get_pixel_bounds(box.x0, box.y0, box.x1, box.y1, *mask.shape)
+    return y0, x0, mask[y0:y1, x0:x1].copy()
@@ -0,0 +1,129 @@
+"""Profiling of Dash callbacks.
+
+If the environment variable `PROFILER` is set, every server-side callback is run with a deterministic profiler
+(cProfile). The profiles of the slowest invocations of each process are stored in `data/profiles` (can be inspected
+e.g. with `snakeviz` or `python -m pstats`), along with a summary of the slowest invocations of the process.
+"""
+
+import cProfile
+import heapq
+import itertools
+import os
+import threading
+import time
+from functools import wraps
+from typing import Callable, List, Tuple
+
+import dash
+
+from .paths import PROFILES_ROOT
+
+# Number of invocations, which are listed in the summary of the slowest invocations.
+PROFILER_SUMMARY_SIZE = int(os.getenv("PROFILER_SUMMARY_SIZE", 20))
+
+# Number of profiles, which are kept per process. Profiles of faster invocations are replaced by slower ones.
+PROFILER_MAX_PROFILES = max(1, int(os.getenv("PROFILER_MAX_PROFILES", 100)))
+
+# Profiles of invocations, which are faster than this number of milliseconds, are not stored (e.g. of the intervals,
+# which renew leases or poll the progress of an evaluation).
+PROFILER_MIN_DURATION = float(os.getenv("PROFILER_MIN_DURATION_MS", 100)) / 1000
+
+# Slowest invocations of the current process: duration in seconds, callback name and profile file name.
+_slowest_calls = []  # type: List[Tuple[float, str, str]]
+_slowest_calls_lock = threading.Lock()
+_call_counter = itertools.count()
+
+
+def initialize_if_needed(app: dash.Dash):
+    """Wrap all server-side callbacks of an app with a profiler, if needed. Must be called after all callbacks have
+    been registered.
+
+    :param app: Dash app.
+    """
+    USE_PROFILER = os.getenv("PROFILER", "False").lower() in ("true", "1", "t")
+
+    if USE_PROFILER:
+        PROFILES_ROOT.mkdir(exist_ok=True, parents=True)
+
+        num_callbacks = 0
+        for callback_spec in app.callback_map.values():
+            if "callback" in callback_spec:  # Clientside callbacks are not run on the server.
+                callback_spec["callback"] = profile_callback(callback_spec["callback"])
+                num_callbacks += 1
+
+        print(
+            f"⏱️ Profiling {num_callbacks} callbacks, profiles are stored in {PROFILES_ROOT}",
+            flush=True,
+        )
+
+
+def profile_callback(callback: Callable) -> Callable:
+    """Wrap a callback, so that every invocation is profiled.
+
+    :param callback: Callback function.
+    :return: Profiled callback function.
+    """
+    name = getattr(callback, "__name__", "callback")
+
+    @wraps(callback)
+    def profiled_callback(*args, **kwargs):
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            profile.disable()
+            duration = time.perf_counter() - start
+
+            if duration >= PROFILER_MIN_DURATION and _is_among_slowest(duration):
+                profile_name = f"{name}_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{next(_call_counter)}.prof"
+                profile_path = PROFILES_ROOT / profile_name
+                profile.dump_stats(str(profile_path))
+                _record_call(duration, name, profile_name)
+
+    return profiled_callback
+
+
+def _is_among_slowest(duration: float) -> bool:
+    """Check if an invocation is slow enough, that its profile is kept.
+
+    :param duration: Duration of the invocation in seconds.
+    :return: True, if the invocation is among the `PROFILER_MAX_PROFILES` slowest invocations, false, if not.
+    """
+    with _slowest_calls_lock:
+        return len(_slowest_calls) < PROFILER_MAX_PROFILES or duration > _slowest_calls[0][0]
+
+
+def _record_call(duration: float, name: str, profile_name: str):
+    """Add an invocation to the slowest invocations, remove the profile of the invocation, which is replaced by it,
+    and rewrite the summary of the current process (`summary_<pid>.txt`).
+
+    :param duration: Duration of the invocation in seconds.
+    :param name: Name of the callback.
+    :param profile_name: File name of the profile.
+    """
+    with _slowest_calls_lock:
+        entry = (duration, name, profile_name)
+        if len(_slowest_calls) < PROFILER_MAX_PROFILES:
+            heapq.heappush(_slowest_calls, entry)
+        else:
+            removed_profile_name = heapq.heappushpop(_slowest_calls, entry)[2]
+            try:
+                os.remove(str(PROFILES_ROOT / removed_profile_name))
+            except FileNotFoundError:
+                pass
+
+        lines = [f"{'duration / ms':>14}  {'callback':<40}  profile"]
+        lines += [
+            f"{duration * 1000:14.1f}  {name:<40}  {profile_name}"
+            for duration, name, profile_name in heapq.nlargest(
+                PROFILER_SUMMARY_SIZE, _slowest_calls
+            )
+        ]
+
+        summary_path = PROFILES_ROOT / f"summary_{os.getpid()}.txt"
+        temporary_path = PROFILES_ROOT / f".summary_{os.getpid()}.partial.txt"
+        temporary_path.write_text("\n".join(lines) + "\n")
+        os.replace(str(temporary_path), str(summary_path))
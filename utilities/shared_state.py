@@ -0,0 +1,243 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+from .custom_types import AnyPath
+
+# The state is only shared between the worker processes of a single container, so it is placed in a folder, which is
+# not persisted across restarts of the container.
+STATE_PATH = os.getenv("STATE_PATH", "/tmp/semiautomaticannotation.sqlite")
+
+# Time in seconds, after which a job, whose progress has not been updated, is considered to be dead.
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", 3600))
+
+
+class SQLiteDatabase:
+    """Process- and thread-safe access to a SQLite database."""
+
+    def __init__(self, path: AnyPath, timeout: float = 30):
+        """
+        :param path: Path of the database file.
+        :param timeout: Time in seconds to wait for a lock of the database.
+        """
+        self.path = str(path)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Connection to the database. Every thread (and process) uses its own connection."""
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._create_tables(connection)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run statements in an exclusive transaction.
+
+        :return: Connection to the database.
+        """
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
+
+    def _create_tables(self, connection: sqlite3.Connection):
+        """Create the tables of the database, if they do not exist yet.
+
+        :param connection: Connection to the database.
+        """
+
+
+class SharedState(SQLiteDatabase):
+    """Process- and thread-safe key-value store, backed by SQLite, to share state (e.g. job status or leases)
+    between the worker processes of a WSGI server."""
+
+    def __init__(self, path: AnyPath = STATE_PATH, timeout: float = 30):
+        """
+        :param path: Path of the database file.
+        :param timeout: Time in seconds to wait for a lock of the database.
+        """
+        super().__init__(path, timeout)
+
+    def _create_tables(self, connection: sqlite3.Connection):
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS leases "
+            "(item TEXT PRIMARY KEY, token TEXT NOT NULL, expiry REAL NOT NULL)"
+        )
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Get a value.
+
+        :param key: Key of the value.
+        :param default: Value to return, if the key does not exist.
+        :return: Value of the key.
+        """
+        row = self.connection.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+
+        if row is None:
+            return default
+
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        """Set a value.
+
+        :param key: Key of the value.
+        :param value: JSON-serializable value.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, json.dumps(value))
+        )
+
+    def delete(self, key: str):
+        """Delete a value, if it exists.
+
+        :param key: Key of the value.
+        """
+        self.connection.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def start_job(self, name: str, total: int) -> bool:
+        """Register a job (e.g. an evaluation), unless a job with the same name is already running.
+
+        :param name: Name of the job.
+        :param total: Total number of steps of the job.
+        :return: True, if the job was registered, false, if a job with the same name is already running.
+        """
+        key = f"job:{name}"
+
+        with self.transaction():
+            job = self.get(key)
+
+            if job is not None and _is_job_alive(job):
+                return False
+
+            pid = os.getpid()
+            self.set(
+                key,
+                {
+                    "pid": pid,
+                    "process_start": _get_process_start(pid),
+                    "heartbeat": time.time(),
+                    "total": total,
+                    "done": 0,
+                },
+            )
+            return True
+
+    def update_job(self, name: str, done: int):
+        """Update the progress of a job.
+
+        :param name: Name of the job.
+        :param done: Number of finished steps of the job.
+        """
+        key = f"job:{name}"
+
+        with self.transaction():
+            job = self.get(key)
+            if job is not None:
+                job["done"] = done
+                job["heartbeat"] = time.time()
+                self.set(key, job)
+
+    def finish_job(self, name: str):
+        """Remove a job.
+
+        :param name: Name of the job.
+        """
+        self.delete(f"job:{name}")
+
+    def get_job(self, name: str) -> Optional[Dict[str, int]]:
+        """Get the status of a running job.
+
+        :param name: Name of the job.
+        :return: Dictionary with the keys "pid", "total" and "done" or None, if no such job is running.
+        """
+        job = self.get(f"job:{name}")
+
+        if job is None or not _is_job_alive(job):
+            return None
+
+        return job
+
+
+def _is_job_alive(job: Dict[str, Any]) -> bool:
+    """Check if a job is still running. The state outlives restarts of the server, and process ids are reused (e.g.
+    they start from 1 again in a restarted container), so a job is only considered to be alive, if its process has
+    the same start time as when the job was registered and its progress has been updated recently.
+
+    :param job: Job, as stored by `SharedState.start_job`.
+    :return: True, if the job is running, false, if not.
+    """
+    if time.time() - job.get("heartbeat", 0) > JOB_TIMEOUT:
+        return False
+
+    return _is_process_alive(job["pid"]) and job.get("process_start") == _get_process_start(
+        job["pid"]
+    )
+
+
+def _get_process_start(pid: int) -> Optional[int]:
+    """Get the start time of a process, which tells apart processes, which have the same process id.
+
+    :param pid: Process id.
+    :return: Start time in clock ticks since boot or None, if it is not available (e.g. on other systems than Linux).
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            stat = file.read()
+    except OSError:
+        return None
+
+    # The name of the process may contain spaces and parentheses, so the fields are counted from its end.
+    return int(stat.rsplit(")", 1)[1].split()[19])
+
+
+def _is_process_alive(pid: int) -> bool:
+    """Check if a process is still running, e.g. to detect jobs of crashed worker processes.
+
+    :param pid: Process id.
+    :return: True, if the process is running, false, if not.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_shared_state = None  # type: Optional[SharedState]
+
+
+def get_shared_state() -> SharedState:
+    """Get the shared state of the application.
+
+    :return: Shared state.
+    """
+    global _shared_state
+
+    if _shared_state is None:
+        _shared_state = SharedState()
+
+    return _shared_state